@@ -6,11 +6,26 @@ There are no restrictions on the size of the image.
 Written by Irmen de Jong (irmen@razorvine.net) - Code is in the Public Domain.
 
 Requirements: Pillow  (pip install pillow)
+Optional: NumPy  (pip install numpy)  makes the pixel conversions a lot faster, especially for large images.
+
+It can also be used from the command line to convert a batch of images to .BIN (pixel data) and .PAL (palette) files
+that can be loaded directly into Vera memory, see  python cx16images.py --help
 """
 
+import argparse
+import concurrent.futures
+import glob
+import itertools
+import os
+import sys
 from PIL import Image
 from typing import TypeAlias, Tuple, Optional
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 RGBList: TypeAlias = list[tuple[int, int, int]]
 
 # the 256 default colors of the Commander X16's color palette in (r,g,b) format
@@ -93,6 +108,8 @@ class BitmapImage:
         Get a rectangle of pixel values from the image, returns the bytes as a flat array
         """
         assert self.has_palette()
+        if numpy is not None:
+            return bytearray(self._pixel_array(x, y, width, height).tobytes())
         data = bytearray(width * height)
         index = 0
         pix = self.img.load()
@@ -117,6 +134,8 @@ class BitmapImage:
         Every byte encodes 2 pixels (4+4 bits).
         """
         assert self.has_palette()
+        if numpy is not None:
+            return _pack_pixels(self._pixel_array(x, y, width, height), 4)
         data = bytearray(width // 2 * height)
         index = 0
         pix = self.img.load()
@@ -135,6 +154,8 @@ class BitmapImage:
         Every byte encodes 2 pixels (4+4 bits).
         """
         assert self.has_palette()
+        if numpy is not None:
+            return _pack_pixels(self._pixel_array(0, 0, self.width, self.height), 4)
         data = bytearray(self.width // 2 * self.height)
         index = 0
         pix = self.img.load()
@@ -146,6 +167,63 @@ class BitmapImage:
                 index += 1
         return data
 
+    def get_pixels_2bpp(self, x: int, y: int, width: int, height: int) -> bytearray:
+        """
+        For 2 bpp (4 color) images:
+        Get a rectangle of pixel values from the image, returns the bytes as a flat array.
+        Every byte encodes 4 pixels (2+2+2+2 bits), the leftmost pixel in the highest bits.
+        """
+        return self._get_packed_pixels(x, y, width, height, 2)
+
+    def get_all_pixels_2bpp(self) -> bytearray:
+        """
+        For 2 bpp (4 color) images:
+        Get all pixel values from the image, returns the bytes as a flat array.
+        Every byte encodes 4 pixels (2+2+2+2 bits), the leftmost pixel in the highest bits.
+        """
+        return self._get_packed_pixels(0, 0, self.width, self.height, 2)
+
+    def get_pixels_1bpp(self, x: int, y: int, width: int, height: int) -> bytearray:
+        """
+        For 1 bpp (2 color) images:
+        Get a rectangle of pixel values from the image, returns the bytes as a flat array.
+        Every byte encodes 8 pixels (1 bit each), the leftmost pixel in the highest bit.
+        """
+        return self._get_packed_pixels(x, y, width, height, 1)
+
+    def get_all_pixels_1bpp(self) -> bytearray:
+        """
+        For 1 bpp (2 color) images:
+        Get all pixel values from the image, returns the bytes as a flat array.
+        Every byte encodes 8 pixels (1 bit each), the leftmost pixel in the highest bit.
+        """
+        return self._get_packed_pixels(0, 0, self.width, self.height, 1)
+
+    def _get_packed_pixels(self, x: int, y: int, width: int, height: int, bits_per_pixel: int) -> bytearray:
+        """Get a rectangle of pixel values from the image, packed into bytes as Vera expects them for the given bits per pixel."""
+        assert self.has_palette()
+        per_byte = 8 // bits_per_pixel
+        assert width % per_byte == 0, f"width must be a multiple of {per_byte}"
+        if numpy is not None:
+            return _pack_pixels(self._pixel_array(x, y, width, height), bits_per_pixel)
+        data = bytearray(width // per_byte * height)
+        index = 0
+        pix = self.img.load()
+        for py in range(y, y + height):
+            for px in range(x, x + width, per_byte):
+                value = 0
+                for pi in range(px, px + per_byte):
+                    value = value << bits_per_pixel | pix[pi, py]
+                data[index] = value
+                index += 1
+        return data
+
+    def _pixel_array(self, x: int, y: int, width: int, height: int) -> "numpy.ndarray":
+        """The pixel values in a rectangle of the (indexed colors) image as a 2-dimensional NumPy array of bytes [row, column]"""
+        if x < 0 or y < 0 or x + width > self.width or y + height > self.height:
+            raise IndexError("image index out of range")
+        return numpy.asarray(self.img.crop((x, y, x + width, y + height)), dtype=numpy.uint8)
+
     def quantize_to(self, palette_rgb12: RGBList, dither: Image.Dither = Image.Dither.FLOYDSTEINBERG) -> None:
         """
         Convert the image to one with the supplied palette.
@@ -163,6 +241,13 @@ class BitmapImage:
         palette_image.putpalette(palette)
         self.img = self.img.quantize(dither=dither, palette=palette_image)
 
+    def quantize_with(self, quantizer: "PaletteQuantizer", dither: bool = False) -> None:
+        """
+        Convert the image to one with the palette of the given quantizer, see PaletteQuantizer.
+        This is a lot faster than quantize_to() if many images have to be converted to the same palette.
+        """
+        self.img = quantizer.quantize(self.img, dither)
+
     def quantize(self, bits_per_pixel: int, preserve_first_16_colors: bool = False, fixed_color_zero: Optional[Tuple[int, int, int]] = None,
                  dither: Image.Dither = Image.Dither.FLOYDSTEINBERG) -> None:
         """
@@ -173,21 +258,9 @@ class BitmapImage:
         preserve_first_16_colors:  set to True to keep the first 16 colors in the palette the same as the X16's default palette.
         fixed_color_zero: set to tuple (R,G,B) to keep the first color entry in the palette to the given fixed color (4 bit per color channel color space).
         """
-        assert not(preserve_first_16_colors and fixed_color_zero), "preserve 16 and fixed color 0 are mutually exclusive"
-        if bits_per_pixel == 8:
-            num_colors = 240 if preserve_first_16_colors else (255 if fixed_color_zero else 256)
-        elif bits_per_pixel == 4:
-            num_colors = 15 if fixed_color_zero else 16
-            if num_colors==16 and preserve_first_16_colors:
-                return self.quantize_to(default_colors[:16], 0)
-        elif bits_per_pixel == 2:
-            assert preserve_first_16_colors==False, "bpp is too small for 16 default colors"
-            num_colors = 3 if fixed_color_zero else 4
-        elif bits_per_pixel == 1:
-            assert preserve_first_16_colors==False, "bpp is too small for 16 default colors"
-            num_colors = 1 if fixed_color_zero else 2
-        else:
-            raise ValueError("only 8,4,2,1 bpp supported")
+        num_colors = _free_palette_colors(bits_per_pixel, preserve_first_16_colors, fixed_color_zero)
+        if num_colors == 0:
+            return self.quantize_to(default_colors[:16], 0)
         image = self.img.convert("RGB")
         palette_image = image.quantize(colors=num_colors, dither=Image.Dither.NONE, method=Image.Quantize.MAXCOVERAGE)
         if len(palette_image.getpalette()) // 3 > num_colors:
@@ -216,8 +289,263 @@ class BitmapImage:
         self.width, self.height = self.size
 
 
+class PaletteQuantizer:
+    """
+    Converts images to a fixed palette in 12 bits colorspace (4 bits so 0-15 per channel).
+    Because there are only 4096 colors in that colorspace, the nearest palette color of every one of them is looked up once,
+    in a table that is reused for every image that is quantized with this object.
+    Converting an image is then just reducing every pixel to 12 bits and looking up its palette index.
+    """
+
+    def __init__(self, palette_rgb12: RGBList) -> None:
+        assert 0 < len(palette_rgb12) <= 256, "palette must have 1 to 256 colors"
+        self.palette = list(palette_rgb12)
+        self.palette_8bits = [(r << 4 | r, g << 4 | g, b << 4 | b) for r, g, b in self.palette]
+        # lookup table of the palette index for every 12 bits color, index is r << 8 | g << 4 | b
+        if numpy is not None:
+            colors = numpy.indices((16, 16, 16)).reshape(3, 4096).T
+            differences = colors[:, None, :] - numpy.array(self.palette)[None, :, :]
+            self.lut = numpy.argmin((differences * differences).sum(axis=2), axis=1).astype(numpy.uint8)
+        else:
+            self.lut = bytearray(4096)
+            for color in range(4096):
+                r, g, b = color >> 8, (color >> 4) & 15, color & 15
+                distances = [(r - pr) ** 2 + (g - pg) ** 2 + (b - pb) ** 2 for pr, pg, pb in self.palette]
+                self.lut[color] = distances.index(min(distances))
+
+    def quantize(self, image: Image, dither: bool = False) -> Image:
+        """
+        Returns the image converted to indexed colors with this palette (extended to 8 bits per channel again, like quantize_to() does).
+        If dither is True, the error of every row of pixels is diffused into the next row (1/4 down-left, 1/2 down, 1/4 down-right).
+        This row-wise error diffusion can be done for a whole row at once, so it is a lot faster than Floyd-Steinberg dithering.
+        """
+        rgb = image.convert("RGB")
+        if numpy is not None:
+            indices = self._quantize_array(numpy.asarray(rgb, dtype=numpy.int32), dither)
+            result = Image.frombytes("P", rgb.size, indices.tobytes())
+        else:
+            result = Image.new("P", rgb.size)
+            result.putdata(self._quantize_pixels(rgb, dither))
+        result.putpalette(rgb_palette_to_flat(self.palette_8bits))
+        return result
+
+    def _lookup(self, pixels: "numpy.ndarray") -> "numpy.ndarray":
+        """palette indices of an array of 8 bits per channel rgb values [..., 3]"""
+        channels = (pixels * 15 + 135) >> 8     # channel_8to4
+        return self.lut[channels[..., 0] << 8 | channels[..., 1] << 4 | channels[..., 2]]
+
+    def _quantize_array(self, pixels: "numpy.ndarray", dither: bool) -> "numpy.ndarray":
+        if not dither:
+            return self._lookup(pixels)
+        palette = numpy.array(self.palette_8bits, dtype=numpy.int32)
+        indices = numpy.empty(pixels.shape[:2], dtype=numpy.uint8)
+        error = numpy.zeros(pixels.shape[1:], dtype=numpy.int32)
+        for y in range(pixels.shape[0]):
+            row = numpy.clip(pixels[y] + error, 0, 255)
+            indices[y] = self._lookup(row)
+            row_error = row - palette[indices[y]]
+            # rounded symmetrically around zero, a shift would round negative errors down and darken the image
+            quarter = numpy.sign(row_error) * ((numpy.abs(row_error) + 2) >> 2)
+            error = row_error - 2 * quarter
+            error[1:] += quarter[:-1]
+            error[:-1] += quarter[1:]
+        return indices
+
+    def _quantize_pixels(self, image: Image, dither: bool) -> list[int]:
+        width, height = image.size
+        pix = image.load()
+        indices = []
+        error = [(0, 0, 0)] * width
+        for y in range(height):
+            next_error = [[0, 0, 0] for _ in range(width)]
+            for x in range(width):
+                color = [min(255, max(0, c + e)) for c, e in zip(pix[x, y], error[x])] if dither else pix[x, y]
+                r, g, b = color
+                index = self.lut[channel_8to4(r) << 8 | channel_8to4(g) << 4 | channel_8to4(b)]
+                indices.append(index)
+                if dither:
+                    for channel in range(3):
+                        channel_error = color[channel] - self.palette_8bits[index][channel]
+                        quarter = _quarter_error(channel_error)
+                        next_error[x][channel] += channel_error - 2 * quarter
+                        if x > 0:
+                            next_error[x - 1][channel] += quarter
+                        if x < width - 1:
+                            next_error[x + 1][channel] += quarter
+            error = next_error
+        return indices
+
+
+def _quarter_error(error: int) -> int:
+    """a quarter of the error rounded to the nearest integer, symmetrically around zero (so that dithering has no bias)"""
+    quarter = (abs(error) + 2) >> 2
+    return quarter if error >= 0 else -quarter
+
+
+# palettes shared by many images
+
+def color_histogram(image: Image) -> list[int]:
+    """
+    Counts the number of pixels of every color of the image, after reducing it to 12 bits colorspace.
+    Returns a list of 4096 counts, the index is the color as r << 8 | g << 4 | b (4 bits per channel).
+    """
+    rgb = image.convert("RGB")
+    if numpy is not None:
+        channels = (numpy.asarray(rgb, dtype=numpy.int32) * 15 + 135) >> 8     # channel_8to4
+        colors = channels[..., 0] << 8 | channels[..., 1] << 4 | channels[..., 2]
+        return numpy.bincount(colors.ravel(), minlength=4096).tolist()
+    histogram = [0] * 4096
+    for count, (r, g, b) in rgb.getcolors(rgb.width * rgb.height):
+        histogram[channel_8to4(r) << 8 | channel_8to4(g) << 4 | channel_8to4(b)] += count
+    return histogram
+
+
+def _file_color_histogram(filename: str, constrain: Optional[str] = None, max_size: Optional[Tuple[int, int]] = None) -> list[int]:
+    return color_histogram(load_resized_image(filename, constrain, max_size).img)
+
+
+def color_histograms(filenames: list[str], processes: Optional[int] = None, constrain: Optional[str] = None,
+                     max_size: Optional[Tuple[int, int]] = None) -> list[int]:
+    """
+    The combined color histogram (see color_histogram()) of all the given image files.
+    The images are loaded and counted in parallel by a pool of processes (default: one per cpu core).
+    The images can be made smaller first, in the same way as load_resized_image() does.
+    """
+    total = [0] * 4096
+    with concurrent.futures.ProcessPoolExecutor(processes) as pool:
+        for histogram in pool.map(_file_color_histogram, filenames, itertools.repeat(constrain), itertools.repeat(max_size)):
+            total = [t + h for t, h in zip(total, histogram)]
+    return total
+
+
+def optimal_palette(histogram: list[int], bits_per_pixel: int, preserve_first_16_colors: bool = False,
+                    fixed_color_zero: Optional[Tuple[int, int, int]] = None, iterations: int = 20) -> RGBList:
+    """
+    Chooses the palette (in 12 bits colorspace) that represents the colors in the histogram best, see color_histogram().
+    The colors are clustered with k-means in the 12 bits colorspace, where every color is weighted by its number of pixels.
+    The palette options are the same as for BitmapImage.quantize(): the fixed colors are kept in front of the palette,
+    and take part in the clustering without being moved.
+    """
+    num_colors = _free_palette_colors(bits_per_pixel, preserve_first_16_colors, fixed_color_zero)
+    fixed = default_colors[:16] if preserve_first_16_colors else ([fixed_color_zero] if fixed_color_zero else [])
+    used = [(color >> 8, (color >> 4) & 15, color & 15) for color, count in enumerate(histogram) if count]
+    weights = [count for count in histogram if count]
+    if num_colors == 0:
+        return fixed
+    if len(used) <= num_colors:
+        free = sorted((color for color in used if color not in fixed), key=lambda color: -weights[used.index(color)])
+        return fixed + free
+    # initial centers: repeatedly the color that is represented worst (by weighted distance), so the most used color comes first
+    centers = []
+    distances = [min((_distance(color, fixed_color) for fixed_color in fixed), default=3 * 16 * 16) for color in used]
+    while len(centers) < num_colors:
+        worst = max(range(len(used)), key=lambda i: weights[i] * distances[i])
+        centers.append(used[worst])
+        distances = [min(d, _distance(color, used[worst])) for d, color in zip(distances, used)]
+    if numpy is not None:
+        centers = _kmeans_numpy(numpy.array(used, dtype=float), numpy.array(weights, dtype=float),
+                                numpy.array(centers, dtype=float), numpy.array(fixed, dtype=float).reshape(-1, 3), iterations)
+    else:
+        centers = _kmeans(used, weights, centers, fixed, iterations)
+    palette = []
+    for center in centers:
+        color = tuple(min(15, max(0, round(c))) for c in center)
+        if color not in palette and color not in fixed:
+            palette.append(color)
+    return fixed + palette
+
+
+def _distance(color1: Tuple[int, int, int], color2: Tuple[int, int, int]) -> int:
+    return (color1[0] - color2[0]) ** 2 + (color1[1] - color2[1]) ** 2 + (color1[2] - color2[2]) ** 2
+
+
+def _kmeans_numpy(colors: "numpy.ndarray", weights: "numpy.ndarray", centers: "numpy.ndarray", fixed: "numpy.ndarray",
+                  iterations: int) -> list[Tuple[float, float, float]]:
+    for _ in range(iterations):
+        all_centers = numpy.concatenate((centers, fixed))
+        differences = colors[:, None, :] - all_centers[None, :, :]
+        nearest = numpy.argmin((differences * differences).sum(axis=2), axis=1)
+        totals = numpy.zeros((len(all_centers), 3))
+        numpy.add.at(totals, nearest, colors * weights[:, None])
+        cluster_weights = numpy.bincount(nearest, weights=weights, minlength=len(all_centers))[:len(centers)]
+        moved = numpy.where(cluster_weights[:, None] > 0, totals[:len(centers)] / numpy.maximum(cluster_weights, 1)[:, None], centers)
+        if numpy.allclose(moved, centers):
+            break
+        centers = moved
+    return [tuple(center) for center in centers]
+
+
+def _kmeans(colors: RGBList, weights: list[int], centers: list, fixed: RGBList, iterations: int) -> list[Tuple[float, float, float]]:
+    for _ in range(iterations):
+        totals = [[0.0, 0.0, 0.0, 0] for _ in centers]
+        for color, weight in zip(colors, weights):
+            nearest = min(range(len(centers)), key=lambda i: _distance(color, centers[i]))
+            if fixed and min(_distance(color, f) for f in fixed) < _distance(color, centers[nearest]):
+                continue    # this color is represented by one of the fixed colors
+            total = totals[nearest]
+            for channel in range(3):
+                total[channel] += color[channel] * weight
+            total[3] += weight
+        moved = [tuple(t / total[3] for t in total[:3]) if total[3] else center for total, center in zip(totals, centers)]
+        if moved == centers:
+            break
+        centers = moved
+    return centers
+
+
+def quantize_images(filenames: list[str], bits_per_pixel: int, preserve_first_16_colors: bool = False,
+                    fixed_color_zero: Optional[Tuple[int, int, int]] = None, dither: bool = False,
+                    processes: Optional[int] = None) -> Tuple[RGBList, list[BitmapImage]]:
+    """
+    Converts all the given image files to indexed colors with one shared palette, so they can be displayed at the same time.
+    The colors of all images are counted (in parallel), the palette that represents them best is chosen with optimal_palette(),
+    and then every image is quantized to that palette (see PaletteQuantizer).
+    Returns the palette (in 12 bits colorspace) and the converted images.
+    """
+    assert not(preserve_first_16_colors and fixed_color_zero), "preserve 16 and fixed color 0 are mutually exclusive"
+    palette = optimal_palette(color_histograms(filenames, processes), bits_per_pixel, preserve_first_16_colors, fixed_color_zero)
+    quantizer = PaletteQuantizer(palette)
+    images = []
+    for filename in filenames:
+        image = BitmapImage(filename)
+        image.quantize_with(quantizer, dither)
+        images.append(image)
+    return palette, images
+
+
 # utility functions
 
+def _pack_pixels(pixels: "numpy.ndarray", bits_per_pixel: int) -> bytearray:
+    """
+    Packs the pixel values in a 2-dimensional NumPy array [row, column] into bytes, row by row.
+    Every byte encodes 8 // bits_per_pixel pixels, the leftmost pixel in the highest bits (as Vera expects).
+    The width must be a multiple of the number of pixels per byte.
+    """
+    per_byte = 8 // bits_per_pixel
+    assert pixels.shape[1] % per_byte == 0, f"width must be a multiple of {per_byte}"
+    packed = numpy.zeros((pixels.shape[0], pixels.shape[1] // per_byte), dtype=numpy.uint8)
+    for i in range(per_byte):
+        packed |= pixels[:, i::per_byte] << (8 - bits_per_pixel * (i + 1))
+    return bytearray(packed.tobytes())
+
+
+def _free_palette_colors(bits_per_pixel: int, preserve_first_16_colors: bool, fixed_color_zero: Optional[Tuple[int, int, int]]) -> int:
+    """The number of palette colors that can be chosen for the image, besides the ones that are fixed"""
+    assert not(preserve_first_16_colors and fixed_color_zero), "preserve 16 and fixed color 0 are mutually exclusive"
+    if bits_per_pixel == 8:
+        return 240 if preserve_first_16_colors else (255 if fixed_color_zero else 256)
+    elif bits_per_pixel == 4:
+        return 0 if preserve_first_16_colors else (15 if fixed_color_zero else 16)
+    elif bits_per_pixel == 2:
+        assert preserve_first_16_colors==False, "bpp is too small for 16 default colors"
+        return 3 if fixed_color_zero else 4
+    elif bits_per_pixel == 1:
+        assert preserve_first_16_colors==False, "bpp is too small for 16 default colors"
+        return 1 if fixed_color_zero else 2
+    else:
+        raise ValueError("only 8,4,2,1 bpp supported")
+
+
 def channel_8to4(color: int) -> int:
     """Accurate conversion of a single 8 bit color channel value to 4 bits"""
     return (color * 15 + 135) >> 8  # see https://threadlocalmutex.com/?p=48
@@ -283,3 +611,168 @@ def rgb_palette_to_vera(palette_rgb: RGBList) -> bytearray:
         data.append(g << 4 | b)
         data.append(r)
     return data
+
+
+# batch conversion from the command line
+
+image_extensions = {".png", ".gif", ".bmp", ".jpg", ".jpeg", ".pcx", ".tga", ".tif", ".tiff", ".webp", ".iff", ".ilbm"}
+
+
+def find_images(inputs: list[str]) -> list[str]:
+    """The image files given by the inputs, which can be file names, directories (all images in it) or glob patterns"""
+    filenames = []
+    for name in inputs:
+        if os.path.isdir(name):
+            filenames.extend(sorted(os.path.join(name, entry) for entry in os.listdir(name)
+                                    if os.path.splitext(entry)[1].lower() in image_extensions))
+        elif glob.has_magic(name):
+            filenames.extend(sorted(glob.glob(name)))
+        else:
+            filenames.append(name)
+    return list(dict.fromkeys(filenames))
+
+
+def output_files(filename: str, output_dir: Optional[str]) -> Tuple[str, str]:
+    """The names of the .BIN and .PAL files that the image is converted to (upper case like the X16's file names)"""
+    base = os.path.splitext(os.path.basename(filename))[0].upper()
+    directory = output_dir if output_dir is not None else os.path.dirname(filename)
+    return os.path.join(directory, base + ".BIN"), os.path.join(directory, base + ".PAL")
+
+
+def is_up_to_date(filenames: list[str], outputs: list[str]) -> bool:
+    """Are all the output files newer than all the input files?"""
+    if not all(os.path.exists(output) for output in outputs):
+        return False
+    return min(os.path.getmtime(output) for output in outputs) >= max(os.path.getmtime(filename) for filename in filenames)
+
+
+def load_resized_image(filename: str, constrain: Optional[str] = None, max_size: Optional[Tuple[int, int]] = None) -> BitmapImage:
+    """
+    Loads an image file, and makes it smaller to fit the lores or hires screen (constrain),
+    or a maximum size (width, height), if it is larger than that.
+    """
+    image = BitmapImage(filename)
+    if constrain:
+        image.constrain_size(hires=constrain == "hires")
+    if max_size and (image.width > max_size[0] or image.height > max_size[1]):
+        image.img.thumbnail(max_size)
+        image.size = image.img.size
+        image.width, image.height = image.size
+    return image
+
+
+def convert_image(filename: str, output_dir: Optional[str], bits_per_pixel: int, constrain: Optional[str] = None,
+                  max_size: Optional[Tuple[int, int]] = None, preserve_first_16_colors: bool = False,
+                  fixed_color_zero: Optional[Tuple[int, int, int]] = None, dither: bool = True,
+                  quantizer: Optional[PaletteQuantizer] = None) -> Tuple[str, str]:
+    """
+    Converts an image file to a .BIN file with the pixel data for the given number of bits per pixel,
+    and a .PAL file with its palette in Vera's format. If a quantizer is given, the image is quantized to its palette
+    (with the fast row-wise dithering of PaletteQuantizer), otherwise it gets its own palette as chosen by BitmapImage.quantize().
+    The image can first be made smaller to fit the lores or hires screen, or a maximum size (see load_resized_image()).
+    Returns the names of the written files.
+    """
+    image = load_resized_image(filename, constrain, max_size)
+    if quantizer:
+        image.quantize_with(quantizer, dither)
+    else:
+        image.quantize(bits_per_pixel, preserve_first_16_colors, fixed_color_zero, Image.Dither.FLOYDSTEINBERG if dither else Image.Dither.NONE)
+    data = getattr(image, f"get_all_pixels_{bits_per_pixel}bpp")()
+    palette = image.get_palette()[:1 << bits_per_pixel]
+    bin_file, pal_file = output_files(filename, output_dir)
+    with open(bin_file, "wb") as out:
+        out.write(data)
+    with open(pal_file, "wb") as out:
+        out.write(rgb_palette_to_vera(palette))
+    return bin_file, pal_file
+
+
+# the quantizer for the shared palette, built once in every worker process of the batch conversion
+_worker_quantizer: Optional[PaletteQuantizer] = None
+
+
+def _init_worker(palette_rgb12: Optional[RGBList]) -> None:
+    global _worker_quantizer
+    _worker_quantizer = PaletteQuantizer(palette_rgb12) if palette_rgb12 else None
+
+
+def _convert_image_in_worker(*args) -> Tuple[str, str]:
+    return convert_image(*args, quantizer=_worker_quantizer)
+
+
+def _parse_size(size: str) -> Tuple[int, int]:
+    width, _, height = size.lower().partition("x")
+    if not width.isdigit() or not height.isdigit():
+        raise argparse.ArgumentTypeError("size should be given as WIDTHxHEIGHT")
+    return int(width), int(height)
+
+
+def _parse_color(color: str) -> Tuple[int, int, int]:
+    if len(color) != 3 or any(c not in "0123456789abcdefABCDEF" for c in color):
+        raise argparse.ArgumentTypeError("color should be given as 3 hexadecimal digits RGB (4 bits per channel)")
+    return int(color[0], 16), int(color[1], 16), int(color[2], 16)
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Converts images to .BIN (pixel data) and .PAL (palette) files for the Commander X16's Vera. "
+                                                 "The images are converted in parallel, images whose output files are up to date are skipped.")
+    parser.add_argument("inputs", nargs="+", help="image files, directories (all images in them) or glob patterns")
+    parser.add_argument("-b", "--bpp", type=int, choices=[8, 4, 2, 1], default=8, help="bits per pixel (default 8)")
+    parser.add_argument("-o", "--outdir", help="directory to write the output files to (default: next to the images)")
+    parser.add_argument("--constrain", choices=["lores", "hires"], help="make images smaller that don't fit on the lores or hires screen")
+    parser.add_argument("--maxsize", type=_parse_size, metavar="WxH", help="make images smaller that are larger than this size")
+    parser.add_argument("--preserve16", action="store_true", help="keep the first 16 colors of the palette the same as the X16's default palette")
+    parser.add_argument("--color0", type=_parse_color, metavar="RGB", help="fix the first color of the palette to this color (3 hex digits)")
+    parser.add_argument("--shared", action="store_true", help="convert all images to one shared palette")
+    parser.add_argument("--nodither", action="store_true", help="don't dither the images")
+    parser.add_argument("-f", "--force", action="store_true", help="also convert the images whose output files are up to date")
+    parser.add_argument("-j", "--jobs", type=int, help="number of processes to use (default: number of cpu cores)")
+    args = parser.parse_args(argv)
+    if args.preserve16 and args.color0:
+        parser.error("--preserve16 and --color0 are mutually exclusive")
+    if args.preserve16 and args.bpp < 4:
+        parser.error("--preserve16 needs at least 4 bits per pixel to hold the 16 default colors")
+    filenames = find_images(args.inputs)
+    if not filenames:
+        parser.error("no images found")
+    written_by = {}
+    for filename in filenames:
+        for output in output_files(filename, args.outdir):
+            key = os.path.normcase(os.path.abspath(output))
+            if key in written_by:
+                parser.error(f"{written_by[key]} and {filename} would both be converted to {output}")
+            written_by[key] = filename
+    if args.outdir:
+        os.makedirs(args.outdir, exist_ok=True)
+    if args.force:
+        todo = filenames
+    elif args.shared:
+        # every image depends on all images because of the shared palette
+        outputs = [output for filename in filenames for output in output_files(filename, args.outdir)]
+        todo = [] if is_up_to_date(filenames, outputs) else filenames
+    else:
+        todo = [filename for filename in filenames if not is_up_to_date([filename], list(output_files(filename, args.outdir)))]
+    print(f"{len(filenames)} images, {len(filenames) - len(todo)} up to date")
+    if not todo:
+        return
+    palette = None
+    if args.shared:
+        palette = optimal_palette(color_histograms(todo, args.jobs, args.constrain, args.maxsize), args.bpp, args.preserve16, args.color0)
+        print(f"shared palette of {len(palette)} colors")
+    failed = 0
+    with concurrent.futures.ProcessPoolExecutor(args.jobs, initializer=_init_worker, initargs=(palette,)) as pool:
+        futures = {pool.submit(_convert_image_in_worker, filename, args.outdir, args.bpp, args.constrain, args.maxsize,
+                               args.preserve16, args.color0, not args.nodither): filename for filename in todo}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                bin_file, pal_file = future.result()
+                print(f"{futures[future]} -> {bin_file}, {pal_file}")
+            except Exception as x:
+                print(f"{futures[future]}: error: {x}", file=sys.stderr)
+                failed += 1
+    if failed:
+        sys.exit(f"{failed} images could not be converted")
+
+
+if __name__ == "__main__":
+    main()
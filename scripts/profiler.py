@@ -7,6 +7,9 @@ a memory access statistics dump file (produced by the X16 emulator's -memorystat
 and prints out what assembly lines and variables were read from and written to the most.
 These may indicate hot paths or even bottlenecks in your program,
 and what variables in system ram might be better placed in Zeropage.
+Instead of the assembly list file you can also give it the label file that 64tass writes
+(the .vice-mon-list file that Prog8 always creates). That is a lot smaller and faster to load,
+but it only gives the symbols, so the analyses that need the instructions are not possible then.
 
 Also see https://prog8.readthedocs.io/en/latest/technical.html#run-time-memory-profiling-with-the-x16-emulator
 for an example of how to use this tool together with the X16 emulator.
@@ -14,19 +17,224 @@ for an example of how to use this tool together with the X16 emulator.
 
 
 import argparse
+import array
+import bisect
+import concurrent.futures
+import contextlib
+import csv
+import functools
+import hashlib
+import heapq
+import itertools
+import json
 import operator
-from typing import Tuple
+import os
+import pickle
+import re
+import sys
+from typing import Tuple, Optional, NamedTuple, TextIO, Iterator, Iterable, Union, Collection, Callable
+
+
+# the 65C02 instruction set: mnemonic followed by addressing mode:opcode:base cycles
+# (the base cycles don't include the extra cycles for taken branches, crossing a page boundary, or decimal mode)
+_opcodes = """
+adc imm:69:2 zp:65:3 zpx:75:4 abs:6d:4 absx:7d:4 absy:79:4 indx:61:6 indy:71:5 izp:72:5
+and imm:29:2 zp:25:3 zpx:35:4 abs:2d:4 absx:3d:4 absy:39:4 indx:21:6 indy:31:5 izp:32:5
+asl acc:0a:2 zp:06:5 zpx:16:6 abs:0e:6 absx:1e:6
+bcc rel:90:2
+bcs rel:b0:2
+beq rel:f0:2
+bit imm:89:2 zp:24:3 zpx:34:4 abs:2c:4 absx:3c:4
+bmi rel:30:2
+bne rel:d0:2
+bpl rel:10:2
+bra rel:80:3
+brk imp:00:7
+bvc rel:50:2
+bvs rel:70:2
+clc imp:18:2
+cld imp:d8:2
+cli imp:58:2
+clv imp:b8:2
+cmp imm:c9:2 zp:c5:3 zpx:d5:4 abs:cd:4 absx:dd:4 absy:d9:4 indx:c1:6 indy:d1:5 izp:d2:5
+cpx imm:e0:2 zp:e4:3 abs:ec:4
+cpy imm:c0:2 zp:c4:3 abs:cc:4
+dec acc:3a:2 zp:c6:5 zpx:d6:6 abs:ce:6 absx:de:7
+dex imp:ca:2
+dey imp:88:2
+eor imm:49:2 zp:45:3 zpx:55:4 abs:4d:4 absx:5d:4 absy:59:4 indx:41:6 indy:51:5 izp:52:5
+inc acc:1a:2 zp:e6:5 zpx:f6:6 abs:ee:6 absx:fe:7
+inx imp:e8:2
+iny imp:c8:2
+jmp abs:4c:3 ind:6c:6 iax:7c:6
+jsr abs:20:6
+lda imm:a9:2 zp:a5:3 zpx:b5:4 abs:ad:4 absx:bd:4 absy:b9:4 indx:a1:6 indy:b1:5 izp:b2:5
+ldx imm:a2:2 zp:a6:3 zpy:b6:4 abs:ae:4 absy:be:4
+ldy imm:a0:2 zp:a4:3 zpx:b4:4 abs:ac:4 absx:bc:4
+lsr acc:4a:2 zp:46:5 zpx:56:6 abs:4e:6 absx:5e:6
+nop imp:ea:2
+ora imm:09:2 zp:05:3 zpx:15:4 abs:0d:4 absx:1d:4 absy:19:4 indx:01:6 indy:11:5 izp:12:5
+pha imp:48:3
+php imp:08:3
+phx imp:da:3
+phy imp:5a:3
+pla imp:68:4
+plp imp:28:4
+plx imp:fa:4
+ply imp:7a:4
+rol acc:2a:2 zp:26:5 zpx:36:6 abs:2e:6 absx:3e:6
+ror acc:6a:2 zp:66:5 zpx:76:6 abs:6e:6 absx:7e:6
+rti imp:40:6
+rts imp:60:6
+sbc imm:e9:2 zp:e5:3 zpx:f5:4 abs:ed:4 absx:fd:4 absy:f9:4 indx:e1:6 indy:f1:5 izp:f2:5
+sec imp:38:2
+sed imp:f8:2
+sei imp:78:2
+sta zp:85:3 zpx:95:4 abs:8d:4 absx:9d:5 absy:99:5 indx:81:6 indy:91:6 izp:92:5
+stp imp:db:3
+stx zp:86:3 zpy:96:4 abs:8e:4
+sty zp:84:3 zpx:94:4 abs:8c:4
+stz zp:64:3 zpx:74:4 abs:9c:4 absx:9e:5
+tax imp:aa:2
+tay imp:a8:2
+trb zp:14:5 abs:1c:6
+tsb zp:04:5 abs:0c:6
+tsx imp:ba:2
+txa imp:8a:2
+txs imp:9a:2
+tya imp:98:2
+wai imp:cb:3
+"""
+
+_mode_sizes = {"imp": 1, "acc": 1, "imm": 2, "zp": 2, "zpx": 2, "zpy": 2, "indx": 2, "indy": 2, "izp": 2, "rel": 2,
+               "abs": 3, "absx": 3, "absy": 3, "ind": 3, "iax": 3, "zpr": 3}
+
+
+class Opcode(NamedTuple):
+    mnemonic: str
+    mode: str
+    size: int
+    cycles: int
+
+
+class Instruction(NamedTuple):
+    address: int
+    opcode: Opcode
+    operand: int        # operand bytes as a little-endian value (zpr mode: zeropage address in the low byte, branch offset in the high byte)
+    line_number: int
+    scope: str
+    bank: int = 0       # the HiRAM bank for instructions in a banked listing
+
+
+opcodes: dict[int, Opcode] = {}
+
+for _line in _opcodes.strip().splitlines():
+    _mnemonic, *_modes = _line.split()
+    for _mode in _modes:
+        _name, _opcode, _cycles = _mode.split(":")
+        opcodes[int(_opcode, 16)] = Opcode(_mnemonic, _name, _mode_sizes[_name], int(_cycles))
+for _bit in range(8):
+    opcodes[0x07 + _bit * 16] = Opcode(f"rmb{_bit}", "zp", 2, 5)
+    opcodes[0x87 + _bit * 16] = Opcode(f"smb{_bit}", "zp", 2, 5)
+    opcodes[0x0f + _bit * 16] = Opcode(f"bbr{_bit}", "zpr", 3, 5)
+    opcodes[0x8f + _bit * 16] = Opcode(f"bbs{_bit}", "zpr", 3, 5)
+
+# instruction mnemonics as they can appear in the assembly source (including 64tass' aliases)
+mnemonics = {opcode.mnemonic for opcode in opcodes.values()} | {"rmb", "smb", "bbr", "bbs", "bge", "blt", "gcc", "gcs", "geq", "gne",
+                                                              "gmi", "gpl", "gvc", "gvs", "gra", "gge", "glt"}
+
+
+def decode(address: int, data: list[int], line_number: int, scope: str, bank: int = 0) -> list[Instruction]:
+    """decodes the bytes of a line of assembly code into instructions, returns an empty list if it's not valid code"""
+    instructions = []
+    offset = 0
+    while offset < len(data):
+        opcode = opcodes.get(data[offset])
+        if opcode is None or offset + opcode.size > len(data):
+            return []
+        operand = int.from_bytes(bytes(data[offset + 1:offset + opcode.size]), "little")
+        instructions.append(Instruction(address + offset, opcode, operand, line_number, scope, bank))
+        offset += opcode.size
+    return instructions
+
+
+class SourceLine(NamedTuple):
+    file: str
+    line: int
+    text: str
+
+
+_cache_version = 2     # increase this when the parsed tables of AsmList change
+_vice_label = re.compile(r"al\s+(?:[a-zA-Z]+:)?(?P<address>[0-9a-fA-F]+)\s+(?P<name>\S+)")
+_dump_label = re.compile(r"\s*(?P<name>[A-Za-z_][\w.]*)\s*=\s*\$(?P<address>[0-9a-fA-F]+)\b")
+_symbol_prefix = re.compile(r"(?<![\w])p8[a-z]_")
+_label = re.compile(r"[A-Za-z_]\w*:?$")
+_source_marker = re.compile(r"; source: (.*?):(\d+)(?:\s+(.*))?$")
+
+
+def strip_prefixes(name: str) -> str:
+    """removes the p8b_/p8s_/p8v_ etc. prefixes that the compiler puts on symbols in the generated assembly"""
+    return _symbol_prefix.sub("", name)
+
+
+def parse_source_marker(text: str) -> Optional[SourceLine]:
+    """parses the '; source: file:line  code' comment that the compiler puts before the assembly code of a Prog8 source line"""
+    match = _source_marker.search(text.rstrip())
+    if match:
+        return SourceLine(match.group(1), int(match.group(2)), (match.group(3) or "").strip())
+    return None
 
 
 class AsmList:
-    """parses a 64tass Turbo Assembler Macro listing file"""
+    """
+    parses a 64tass Turbo Assembler Macro listing file.
+    Instead of a listing, the (much smaller) label file that 64tass writes with the --vice-labels or --dump-labels option
+    can be used as well. That only gives the symbols though: no instructions, and the routine address ranges are estimated.
+    """
 
-    def __init__(self, filename: str) -> None:
+    def __init__(self, filename: str, cache: bool = False, bank: int = 0) -> None:
+        """
+        parses the listing file. If cache is True, the parsed tables are stored in a cache file,
+        and reused as long as the listing file doesn't change (see cache_filename()).
+        The bank is the HiRAM bank that the code in the listing runs in, if it's a listing of banked code.
+        """
+        self.filename = filename
+        self.bank = bank
+        self.banks: dict[int, AsmList] = {}     # the listings of the code and data in HiRAM banks
+        self.memory_map = MemoryMap()     # the system memory areas and registers that are not in the listing
+        self._unprefixed_labels: Optional[dict[str, int]] = None
+        self._label_addresses: Optional[list[int]] = None
+        self._label_names: list[str] = []
+        self._cached: Optional[dict] = None      # the tables loaded from the cache, that the other tables are restored from when needed
+        self._cached_texts: Optional[dict] = None
+        label_format = self.label_file_format(filename)
+        if not label_format and cache and self.load_cache(filename):
+            return
         self.lines = []
+        self.scopes: dict[int, str] = {}     # listing line number -> name of the enclosing .proc/.block scope
+        self.instructions: list[Instruction] = []
+        self.line_texts: dict[int, str] = {}     # listing line number -> text of the line, for the instructions
+        self.sources: dict[int, SourceLine] = {}     # listing line number -> Prog8 source line, for the instructions
+        self.labels: dict[str, int] = {}     # fully scoped label or symbol name -> address
+        if label_format:
+            self.parse_labels(filename, label_format)
+            return
+        self.parse(filename)
+        if cache:
+            self.save_cache(filename)
+
+    def parse(self, filename: str) -> None:
         symbols = {}
+        scope_stack = []
+        extents = {}
+        source_line = None
         self.check_format(filename)
         for index, line in enumerate(open(filename, "rt"), 1):
-            if not line or line == '\n' or line[0] == ';':
+            if not line or line == '\n':
+                continue
+            if line[0] == ';':
+                if "; source: " in line:
+                    source_line = parse_source_marker(line) or source_line
                 continue
             if line[0] == '=':
                 value, symbol = line.split(maxsplit=2)[:2]
@@ -38,21 +246,331 @@ class AsmList:
                         else:
                             address = int(value)
                         symbols[symbol] = (address, index)
+                        self.scopes[index] = ".".join(scope_stack)
+                        self.labels[".".join(scope_stack + [symbol])] = address
                     except ValueError:
                         pass
-            elif line[0] == '>':
-                value, rest = line.split(maxsplit=1)
-                address = int(value[1:], 16)
-                self.lines.append((address, rest.strip(), index))
-            elif line[0] == '.':
+            elif line[0] == '>' or line[0] == '.':
                 value, rest = line.split(maxsplit=1)
                 address = int(value[1:], 16)
                 self.lines.append((address, rest.strip(), index))
+                data, source = self.split_columns(line, value)
+                words = source.split() or [""]
+                if source.startswith("; source: "):
+                    source_line = parse_source_marker(source) or source_line
+                if len(words) >= 2 and words[1] in (".proc", ".block"):
+                    scope_stack.append(words[0])
+                    source_line = None
+                elif words[0] in (".pend", ".bend"):
+                    if scope_stack:
+                        scope_stack.pop()
+                    source_line = None
+                    continue
+                scope = ".".join(scope_stack)
+                self.scopes[index] = scope
+                if len(words) >= 2 and words[1] in (".proc", ".block"):
+                    self.labels[scope] = address
+                elif _label.match(words[0]) and words[0].lower() not in mnemonics:
+                    self.labels[".".join(scope_stack + [words[0].rstrip(':')])] = address
+                extents[address] = (scope, address + max(1, len(data)))
+                if data and (words[0].lower() in mnemonics or len(words) > 1 and words[1].lower() in mnemonics):
+                    self.instructions.extend(decode(address, data, index, scope, self.bank))
+                    self.line_texts[index] = rest.strip()
+                    if source_line:
+                        self.sources[index] = source_line
             else:
                 raise ValueError("invalid syntax: " + line)
         for name, (address, index) in symbols.items():
             self.lines.append((address, name, index))
         self.lines.sort()
+        self.build_index()
+        # address ranges of the routines and blocks: every emitted line extends its scope up to the next emitted line
+        self.range_starts = sorted(extents)
+        self.range_scopes = [extents[address][0] for address in self.range_starts]
+        self.range_ends = self.range_starts[1:] + [extents[self.range_starts[-1]][1]] if extents else []
+        self.instructions.sort()
+
+    @staticmethod
+    def label_file_format(filename: str) -> Optional[str]:
+        """returns 'vice' or 'dump' if the file is a 64tass label file in that format, or None if it isn't a label file"""
+        with open(filename, "rt") as inf:
+            for line in inf:
+                if line.strip() and not line.startswith(';'):
+                    if _vice_label.match(line):
+                        return "vice"
+                    if _dump_label.match(line):
+                        return "dump"
+                    return None
+        return None
+
+    def parse_labels(self, filename: str, label_format: str) -> None:
+        """parses a 64tass label file in VICE monitor format (--vice-labels) or in the 64tass format (--dump-labels)"""
+        pattern = _vice_label if label_format == "vice" else _dump_label
+        for index, line in enumerate(open(filename, "rt"), 1):
+            match = pattern.match(line)
+            if match:
+                address = int(match.group("address"), 16)
+                name = match.group("name").lstrip('.').replace(':', '.')
+                self.labels[name] = address
+                self.scopes[index] = name.rpartition('.')[0]
+                self.lines.append((address, name, index))
+        self.lines.sort()
+        self.build_index()
+        # estimate the address ranges of the routines and blocks: a label that has other labels nested in it
+        # or that has the block or subroutine symbol prefix is a scope, and every label in code or data memory
+        # extends its scope up to the next label.
+        scope_names = {name.rpartition('.')[0] for name in self.labels}
+        scope_names.update(name for name in self.labels if name.rpartition('.')[2].startswith(("p8b_", "p8s_")))
+        low, high = (0xa000, 0xc000) if self.bank else (0x0200, 0xa000)
+        extents = {}
+        for name, address in self.labels.items():
+            if low <= address < high:
+                scope = name if name in scope_names else name.rpartition('.')[0]
+                if address not in extents or scope.count('.') > extents[address].count('.'):
+                    extents[address] = scope
+        self.range_starts = sorted(extents)
+        self.range_scopes = [extents[address] for address in self.range_starts]
+        self.range_ends = self.range_starts[1:] + [self.range_starts[-1] + 1] if extents else []
+
+    def build_index(self) -> None:
+        self.index: dict[int, list[Tuple[int, str, int]]] = {}
+        for entry in self.lines:
+            self.index.setdefault(entry[0], []).append(entry)
+        self.addresses = sorted(self.index)
+
+    @staticmethod
+    def cache_filename(filename: str) -> str:
+        """the cache file for the listing file, in the user's cache directory (respects XDG_CACHE_HOME)"""
+        cache_dir = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+        name = hashlib.sha1(os.path.abspath(filename).encode()).hexdigest()
+        return os.path.join(cache_dir, "prog8-profiler", name + ".cache")
+
+    @staticmethod
+    def cache_key(filename: str) -> Tuple:
+        """the key that the cache is valid for: the listing file's path, size, modification time and content hash"""
+        stat = os.stat(filename)
+        with open(filename, "rb") as inf:
+            digest = hashlib.file_digest(inf, "sha1").hexdigest() if hasattr(hashlib, "file_digest") else hashlib.sha1(inf.read()).hexdigest()
+        return _cache_version, os.path.abspath(filename), stat.st_size, stat.st_mtime_ns, digest
+
+    def load_cache(self, filename: str) -> bool:
+        """
+        restores the parsed tables from the cache, returns False if there is no valid cache for the listing file.
+        Only the compact numeric columns are loaded here, the tables that are built from them (such as the instructions
+        and the address index) and the text columns (that are stored separately in the cache file) are restored when they
+        are first used, see the properties below.
+        """
+        try:
+            with open(self.cache_filename(filename), "rb") as inf:
+                key = pickle.load(inf)
+                if key != self.cache_key(filename):
+                    return False
+                tables = pickle.load(inf)
+                self._texts_offset = inf.tell()
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+            return False
+        self._cached = tables
+        self._cache_file = self.cache_filename(filename)
+        scope_names = tables["scope_names"]
+        self.range_starts = tables["range_starts"].tolist()
+        self.range_ends = tables["range_ends"].tolist()
+        self.range_scopes = [scope_names[i] for i in tables["range_scopes"]]
+        return True
+
+    def cached_texts(self) -> dict:
+        """the text columns from the cache file (loaded on first use)"""
+        if self._cached_texts is None:
+            with open(self._cache_file, "rb") as inf:
+                inf.seek(self._texts_offset)
+                self._cached_texts = pickle.load(inf)
+        return self._cached_texts
+
+    # these properties are only used when the listing was loaded from the cache: they restore the tables from the cached columns
+
+    @functools.cached_property
+    def lines(self) -> list[Tuple[int, str, int]]:
+        return list(zip(self._cached["line_addresses"], self.cached_texts()["line_texts"], self._cached["line_numbers"]))
+
+    @functools.cached_property
+    def scopes(self) -> dict[int, str]:
+        scope_names = self._cached["scope_names"]
+        return dict(zip(self._cached["scope_lines"], (scope_names[i] for i in self._cached["scope_ids"])))
+
+    @functools.cached_property
+    def instructions(self) -> list[Instruction]:
+        scope_names = self._cached["scope_names"]
+        return [Instruction(address, opcodes[opcode], operand, line_number, scope_names[scope], self.bank)
+                for address, opcode, operand, line_number, scope
+                in zip(*(self._cached["instr_" + column] for column in ("addresses", "opcodes", "operands", "lines", "scopes")))]
+
+    @functools.cached_property
+    def line_texts(self) -> dict[int, str]:
+        text_lines = set(self._cached["text_lines"])
+        return {line_number: text for _, text, line_number in self.lines if line_number in text_lines}
+
+    @functools.cached_property
+    def sources(self) -> dict[int, SourceLine]:
+        return {line_number: SourceLine(*source) for line_number, source in zip(self._cached["source_lines"], self.cached_texts()["sources"])}
+
+    @functools.cached_property
+    def labels(self) -> dict[str, int]:
+        return dict(zip(self.cached_texts()["label_names"], self._cached["label_addresses"]))
+
+    @functools.cached_property
+    def index(self) -> dict[int, list[Tuple[int, str, int]]]:
+        self.build_index()
+        return self.index
+
+    @functools.cached_property
+    def addresses(self) -> list[int]:
+        self.build_index()
+        return self.addresses
+
+    def save_cache(self, filename: str) -> None:
+        """
+        stores the parsed tables in the cache: first the numeric columns as compact arrays,
+        then the text columns (so they don't have to be loaded when they're not used)
+        """
+        scope_names = sorted(set(self.scopes.values()) | set(self.range_scopes) | {instr.scope for instr in self.instructions})
+        scope_ids = {name: i for i, name in enumerate(scope_names)}
+        opcode_bytes = {opcode: value for value, opcode in opcodes.items()}
+        tables = {
+            "line_addresses": array.array("I", (line[0] for line in self.lines)),
+            "line_numbers": array.array("I", (line[2] for line in self.lines)),
+            "scope_names": scope_names,
+            "scope_lines": array.array("I", self.scopes.keys()),
+            "scope_ids": array.array("I", (scope_ids[scope] for scope in self.scopes.values())),
+            "instr_addresses": array.array("I", (instr.address for instr in self.instructions)),
+            "instr_opcodes": array.array("B", (opcode_bytes[instr.opcode] for instr in self.instructions)),
+            "instr_operands": array.array("H", (instr.operand for instr in self.instructions)),
+            "instr_lines": array.array("I", (instr.line_number for instr in self.instructions)),
+            "instr_scopes": array.array("I", (scope_ids[instr.scope] for instr in self.instructions)),
+            "text_lines": array.array("I", self.line_texts.keys()),
+            "source_lines": array.array("I", self.sources.keys()),
+            "label_addresses": array.array("I", self.labels.values()),
+            "range_starts": array.array("I", self.range_starts),
+            "range_ends": array.array("I", self.range_ends),
+            "range_scopes": array.array("I", (scope_ids[scope] for scope in self.range_scopes)),
+        }
+        texts = {
+            "line_texts": [line[1] for line in self.lines],
+            "sources": [tuple(source) for source in self.sources.values()],
+            "label_names": list(self.labels.keys()),
+        }
+        cache_filename = self.cache_filename(filename)
+        try:
+            os.makedirs(os.path.dirname(cache_filename), exist_ok=True)
+            with open(cache_filename + ".tmp", "wb") as out:
+                pickle.dump(self.cache_key(filename), out, pickle.HIGHEST_PROTOCOL)
+                pickle.dump(tables, out, pickle.HIGHEST_PROTOCOL)
+                pickle.dump(texts, out, pickle.HIGHEST_PROTOCOL)
+            os.replace(cache_filename + ".tmp", cache_filename)
+        except OSError as x:
+            print("warning: cannot write listing cache file:", x, file=sys.stderr)
+
+    @staticmethod
+    def split_columns(line: str, value: str) -> Tuple[list[int], str]:
+        """splits an address line into the bytes in its hex column (empty for labels etc.) and the source code column"""
+        column, _, source = line[len(value) + 1:].partition('\t')
+        hexes = column.split()
+        try:
+            if all(len(h) == 2 for h in hexes):
+                return [int(h, 16) for h in hexes], source.strip()
+        except ValueError:
+            pass
+        return [], line[len(value):].strip()
+
+    def add_bank(self, listing: "AsmList") -> None:
+        """adds the listing of code and data in a HiRAM bank, the listing's bank number must be set"""
+        self.banks[listing.bank] = listing
+
+    def listing_for(self, bank: int, address: int) -> Optional["AsmList"]:
+        """the listing to look up the address in: this listing for main memory, the listing added for the bank for HiRAM"""
+        if address < 0xa000:
+            return self
+        if address < 0xc000:
+            return self.banks.get(bank)
+        return None
+
+    def listing_of(self, instr: Instruction) -> "AsmList":
+        """the listing that the instruction is from"""
+        return self.banks[instr.bank] if instr.bank else self
+
+    def lookup_label(self, scoped_name: str) -> Optional[int]:
+        """the address of a label or symbol given by its scoped name, the p8b_/p8s_/p8v_ symbol prefixes are optional"""
+        address = self.labels.get(scoped_name)
+        if address is None:
+            if self._unprefixed_labels is None:
+                self._unprefixed_labels = {strip_prefixes(name): addr for name, addr in self.labels.items()}
+            address = self._unprefixed_labels.get(strip_prefixes(scoped_name))
+        return address
+
+    def size_at(self, address: int) -> int:
+        """the number of bytes from the address up to the next address that's in the listing (the size of the variable there)"""
+        pos = bisect.bisect_right(self.addresses, address)
+        return self.addresses[pos] - address if pos < len(self.addresses) else 1
+
+    def routine(self, address: int) -> Optional[str]:
+        """the name of the routine or block that the address belongs to, or None if it's not known"""
+        pos = bisect.bisect_right(self.range_starts, address) - 1
+        if pos >= 0 and address < self.range_ends[pos] and self.range_scopes[pos]:
+            return self.range_scopes[pos]
+        # not in emitted code or data, try the scope of the symbols defined on that address (such as zeropage variables)
+        scopes = [self.scopes.get(index, "") for _, _, index in self.index.get(address, [])]
+        scopes = [scope for scope in scopes if scope]
+        if scopes:
+            return max(scopes, key=lambda scope: scope.count('.'))
+        return None
+
+    def in_listing(self, address: int) -> bool:
+        """is the address in the code or data that is emitted in the listing"""
+        pos = bisect.bisect_right(self.range_starts, address) - 1
+        return pos >= 0 and address < self.range_ends[pos]
+
+    def sort_labels(self) -> None:
+        if self._label_addresses is None:
+            label_at = {}
+            for name, addr in self.labels.items():
+                # on shared addresses prefer the most deeply nested name, such as a routine's variable over its routine
+                if addr not in label_at or name.count('.') > label_at[addr].count('.'):
+                    label_at[addr] = name
+            self._label_addresses = sorted(label_at)
+            self._label_names = [label_at[addr] for addr in self._label_addresses]
+
+    def symbol_range(self, address: int) -> Optional[Tuple[str, int, int]]:
+        """
+        the (scoped) name, start and end address of the label in emitted code or data that the address belongs to,
+        the label ends at the next label (or at the end of the code and data in the listing). None if it's not known.
+        """
+        self.sort_labels()
+        pos = bisect.bisect_right(self._label_addresses, address) - 1
+        range_pos = bisect.bisect_right(self.range_starts, address) - 1
+        if pos < 0 or range_pos < 0 or address >= self.range_ends[range_pos]:
+            return None
+        next_label = self._label_addresses[pos + 1] if pos + 1 < len(self._label_addresses) else 0x10000
+        # the label also ends where the emitted code and data stops (the next label can be a symbol elsewhere in memory)
+        while range_pos + 1 < len(self.range_starts) and self.range_ends[range_pos] < next_label \
+                and self.range_starts[range_pos + 1] <= self.range_ends[range_pos]:
+            range_pos += 1
+        return self._label_names[pos], self._label_addresses[pos], min(next_label, self.range_ends[range_pos])
+
+    def symbol(self, address: int) -> Optional[str]:
+        """
+        the (scoped) name of the label or symbol that the address belongs to, or None if it's not known.
+        In emitted code and data this is the closest label at or before the address, elsewhere the symbol must be
+        defined on the address itself or on the address just before it (such as the high byte of a zeropage word).
+        """
+        self.sort_labels()
+        pos = bisect.bisect_right(self._label_addresses, address) - 1
+        if pos < 0:
+            return None
+        label_address = self._label_addresses[pos]
+        range_pos = bisect.bisect_right(self.range_starts, address) - 1
+        if range_pos >= 0 and address < self.range_ends[range_pos]:
+            return self._label_names[pos]
+        if address - label_address <= 1:
+            return self._label_names[pos]
+        return None
 
     def check_format(self, filename: str) -> None:
         with open(filename, "rt") as inf:
@@ -68,111 +586,1698 @@ class AsmList:
 
     def print_info(self) -> None:
         print("number of actual lines in the assembly listing:", len(self.lines))
+        print("number of decoded instructions in the listing :", len(self.instructions))
 
     def find(self, address: int) -> list[Tuple[int, str, int]]:
-        exact_result = [(line_addr, name, index) for line_addr, name, index in self.lines if line_addr == address]
-        if exact_result:
-            return exact_result
-        fuzzy_result = [(line_addr, name, index) for line_addr, name, index in self.lines if line_addr == address - 1]
-        if fuzzy_result:
-            return fuzzy_result
-        fuzzy_result = [(line_addr, name, index) for line_addr, name, index in self.lines if line_addr == address + 1]
-        if fuzzy_result:
-            return fuzzy_result
+        # exact match first, then fuzzy match on the address just before or just after it
+        for addr in (address, address - 1, address + 1):
+            result = self.index.get(addr)
+            if result:
+                return result
         return []
 
 
+def parse_memorystats(filename: str) -> Iterator[Tuple[bool, int, int, int]]:
+    """yields (is write, bank, address, count) for every read and write count line in a x16emulator memory statistics file"""
+
+    def parse(rest: str) -> Tuple[int, int, int]:
+        if ':' in rest:
+            bank = int(rest[:2], 16)
+            address = int(rest[3:7], 16)
+            count = int(rest[8:])
+        else:
+            bank = 0  # regular system RAM, bank is irrellevant.
+            address = int(rest[:4], 16)
+            count = int(rest[5:])
+        return bank, address, count
+
+    for line in open(filename, "rt"):
+        if line.startswith("r "):
+            yield False, *parse(line[2:])
+        elif line.startswith("w "):
+            yield True, *parse(line[2:])
+
+
+def count_memorystats(filename: str) -> Tuple[dict[int, Tuple[array.array, array.array]], dict]:
+    """
+    reads a x16emulator memory statistics file into fixed size arrays of 64K read and write counts per bank.
+    Returns the arrays per bank, and a summary of the file. (used in a process pool to read many files at once)
+    """
+    banks = {}
+    hottest_read = hottest_write = (0, 0, 0)
+    for is_write, bank, address, count in parse_memorystats(filename):
+        if bank not in banks:
+            banks[bank] = (array.array("Q", bytes(8 * 65536)), array.array("Q", bytes(8 * 65536)))
+        if is_write:
+            banks[bank][1][address] += count
+            hottest_write = max(hottest_write, (count, bank, address))
+        else:
+            banks[bank][0][address] += count
+            hottest_read = max(hottest_read, (count, bank, address))
+    summary = {
+        "file": filename,
+        "total_reads": sum(sum(reads) for reads, _ in banks.values()),
+        "total_writes": sum(sum(writes) for _, writes in banks.values()),
+        "hottest_read": {"bank": hottest_read[1], "address": hottest_read[2], "count": hottest_read[0]},
+        "hottest_write": {"bank": hottest_write[1], "address": hottest_write[2], "count": hottest_write[0]},
+    }
+    return banks, summary
+
+
 class MemoryStats:
-    """parses the read and write counts in a x16emulator memory statistics file"""
+    """
+    parses the read and write counts in a x16emulator memory statistics file.
+    If top is given, the file is parsed in streaming mode: only the top N reads and writes are kept
+    (in bounded heaps) together with running totals, so memory use doesn't depend on the size of the dump.
+    Use MemoryStats.merge() to combine the counts of many memory statistics files.
+    """
 
-    def __init__(self, filename: str) -> None:
+    def __init__(self, filename: str, top: Optional[int] = None) -> None:
         self.check_format(filename)
+        self.files: list[dict] = []     # summary per file, when the counts of multiple files are merged
+        self.collect(parse_memorystats(filename), top)
+
+    @classmethod
+    def merge(cls, filenames: list[str], top: Optional[int] = None, processes: Optional[int] = None) -> "MemoryStats":
+        """
+        combines the read and write counts of many memory statistics files.
+        The files are read in parallel by a pool of processes (default: one per cpu core),
+        and their counts are summed per bank over fixed size 64K arrays.
+        """
+        for filename in filenames:
+            cls.check_format(filename)
+        merged = {}
+        summaries: list[Optional[dict]] = [None] * len(filenames)
+        with concurrent.futures.ProcessPoolExecutor(processes) as pool:
+            futures = {pool.submit(count_memorystats, filename): index for index, filename in enumerate(filenames)}
+            # fold every file's counts into the totals as soon as it is done, so only a few files' arrays are in memory at once
+            for future in concurrent.futures.as_completed(futures):
+                banks, summaries[futures.pop(future)] = future.result()
+                for bank, (reads, writes) in banks.items():
+                    if bank in merged:
+                        # elementwise sums of the arrays, this still adds the 64K counts one by one (it is not vectorized)
+                        merged[bank] = (array.array("Q", map(operator.add, merged[bank][0], reads)),
+                                        array.array("Q", map(operator.add, merged[bank][1], writes)))
+                    else:
+                        merged[bank] = (reads, writes)
+
+        def entries() -> Iterator[Tuple[bool, int, int, int]]:
+            for is_write in (False, True):
+                for bank in sorted(merged):
+                    counts = merged[bank][is_write]
+                    for address in range(65536):
+                        if counts[address]:
+                            yield is_write, bank, address, counts[address]
+
+        stats = cls.__new__(cls)
+        stats.files = summaries
+        stats.collect(entries(), top)
+        return stats
+
+    def collect(self, entries: Iterable[Tuple[bool, int, int, int]], top: Optional[int]) -> None:
         self.reads = []
         self.writes = []
+        self.distinct_reads = 0
+        self.distinct_writes = 0
+        self.total_reads = 0
+        self.total_writes = 0
 
-        def parse(rest: str) -> Tuple[int, int, int]:
-            if ':' in rest:
-                bank = int(rest[:2], 16)
-                address = int(rest[3:7], 16)
-                count = int(rest[8:])
-            else:
-                bank = 0  # regular system RAM, bank is irrellevant.
-                address = int(rest[:4], 16)
-                count = int(rest[5:])
-            return bank, address, count
+        def keep_top(heap: list, seq: int, bank: int, address: int, count: int) -> None:
+            # min-heap on (count, -seq) so on equal counts the entry that came first in the file is kept
+            item = (count, -seq, bank, address)
+            if len(heap) < top:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
 
-        for line in open(filename, "rt"):
-            if line.startswith("r "):
-                bank, address, count = parse(line[2:])
-                self.reads.append(((bank, address), count))
-            elif line.startswith("w "):
-                bank, address, count = parse(line[2:])
-                self.writes.append(((bank, address), count))
-        self.reads.sort(reverse=True, key=operator.itemgetter(1))
-        self.writes.sort(reverse=True, key=operator.itemgetter(1))
+        for seq, (is_write, bank, address, count) in enumerate(entries):
+            if is_write:
+                self.distinct_writes += 1
+                self.total_writes += count
+                if top is None:
+                    self.writes.append(((bank, address), count))
+                elif top > 0:
+                    keep_top(self.writes, seq, bank, address, count)
+            else:
+                self.distinct_reads += 1
+                self.total_reads += count
+                if top is None:
+                    self.reads.append(((bank, address), count))
+                elif top > 0:
+                    keep_top(self.reads, seq, bank, address, count)
+        if top is None:
+            self.reads.sort(reverse=True, key=operator.itemgetter(1))
+            self.writes.sort(reverse=True, key=operator.itemgetter(1))
+        else:
+            self.reads = [((bank, address), count) for count, _, bank, address in sorted(self.reads, reverse=True)]
+            self.writes = [((bank, address), count) for count, _, bank, address in sorted(self.writes, reverse=True)]
 
-    def check_format(self, filename: str) -> None:
+    @staticmethod
+    def check_format(filename: str) -> None:
         with open(filename, "rt") as inf:
             firstline = inf.readline()
             if not firstline.startswith("Usage counts "):
                 raise IOError("memory statistics file is not recognised as a X16 emulator memorystats file")
 
     def print_info(self) -> None:
-        print("number of distinct addresses read from  :", len(self.reads))
-        print("number of distinct addresses written to :", len(self.writes))
-        counts = sum(c for _, c in self.reads)
-        print(f"total number of reads  : {counts} ({counts//1_000_000}M)")
-        counts = sum(c for _, c in self.writes)
-        print(f"total number of writes : {counts} ({counts//1_000_000}M)")
-
-
-def profile(number_of_lines: int, asmlist: str, memstats: str) -> None:
-    """performs profiling analysis of the given assembly listing file based on the given memory stats file"""
-    asm = AsmList(asmlist)
-    stats = MemoryStats(memstats)
-    asm.print_info()
-    stats.print_info()
-
-    def print_unknown(address: int) -> None:
-        if address < 0x100:
-            print("unknown zp")
-        elif address < 0x200:
-            print("cpu stack")
-        elif address in range(0x9f00, 0xa000):
-            print("io")
+        print("number of distinct addresses read from  :", self.distinct_reads)
+        print("number of distinct addresses written to :", self.distinct_writes)
+        print(f"total number of reads  : {self.total_reads} ({self.total_reads//1_000_000}M)")
+        print(f"total number of writes : {self.total_writes} ({self.total_writes//1_000_000}M)")
+
+
+# the Commander X16's system memory areas: "start end device", the ones marked with * can also be used by the program
+_cx16_areas = """
+0000 0000 ram bank
+0001 0001 rom bank
+0002 0021 virtual registers
+0080 00ff kernal zp *
+0100 01ff cpu stack
+0200 03ff kernal variables
+9f00 9f0f VIA #1
+9f10 9f1f VIA #2
+9f20 9f3f VERA
+9f40 9f5f YM2151
+9f60 9fff expansion io
+c000 ffff rom
+"""
+
+# the Commander X16's named registers and kernal variables (the names are the ones in the cx16 module of the library)
+_cx16_registers = {
+    0x0000: "ram_bank", 0x0001: "rom_bank",
+    0x0300: "IERROR", 0x0302: "IMAIN", 0x0304: "ICRNCH", 0x0306: "IQPLOP", 0x0308: "IGONE", 0x030a: "IEVAL", 0x030c: "SAREG",
+    0x030d: "SXREG", 0x030e: "SYREG", 0x030f: "SPREG", 0x0311: "USRADD", 0x0314: "CINV", 0x0316: "CBINV", 0x0318: "NMINV",
+    0x031a: "IOPEN", 0x031c: "ICLOSE", 0x031e: "ICHKIN", 0x0320: "ICKOUT", 0x0322: "ICLRCH", 0x0324: "IBASIN", 0x0326: "IBSOUT",
+    0x0328: "ISTOP", 0x032a: "IGETIN", 0x032c: "ICLALL", 0x032e: "KEYHDL", 0x0330: "ILOAD", 0x0332: "ISAVE", 0x0372: "KERNAL_MODE",
+    0x03b2: "stavec",
+    0x9f40: "YM_ADDRESS", 0x9f41: "YM_DATA",
+}
+for _number in range(16):
+    _cx16_registers[0x02 + _number * 2] = f"r{_number}L"
+    _cx16_registers[0x03 + _number * 2] = f"r{_number}H"
+for _offset, _name in enumerate("prb pra ddrb ddra t1l t1h t1ll t1lh t2l t2h sr acr pcr ifr ier ora".split()):
+    _cx16_registers[0x9f00 + _offset] = "via1" + _name
+    _cx16_registers[0x9f10 + _offset] = "via2" + _name
+# the VERA registers at $9f29-$9f2c have different meanings depending on the DCSEL value in VERA_CTRL
+for _offset, _name in enumerate("ADDR_L ADDR_M ADDR_H DATA0 DATA1 CTRL IEN ISR IRQLINE_L/SCANLINE_L DC_VIDEO/DC_HSTART/FX_CTRL "
+                                "DC_HSCALE/DC_HSTOP/FX_TILEBASE DC_VSCALE/DC_VSTART/FX_MAPBASE DC_BORDER/DC_VSTOP/FX_MULT "
+                                "L0_CONFIG L0_MAPBASE L0_TILEBASE L0_HSCROLL_L L0_HSCROLL_H L0_VSCROLL_L L0_VSCROLL_H "
+                                "L1_CONFIG L1_MAPBASE L1_TILEBASE L1_HSCROLL_L L1_HSCROLL_H L1_VSCROLL_L L1_VSCROLL_H "
+                                "AUDIO_CTRL AUDIO_RATE AUDIO_DATA SPI_DATA SPI_CTRL".split()):
+    _cx16_registers[0x9f20 + _offset] = "VERA_" + _name
+
+
+class MemoryArea(NamedTuple):
+    start: int
+    end: int    # inclusive
+    device: str
+    shared: bool    # the program can also put its own variables in this area
+
+
+class MemoryMap:
+    """
+    the Commander X16's memory map: the system memory areas (grouped per device) and the names of the I/O registers and
+    kernal variables in them, for the addresses that are not in the program's listing.
+    The symbols of the code in the ROM banks can be loaded from label files, such as the ones created by the ROM build.
+    """
+
+    def __init__(self) -> None:
+        self.areas = [MemoryArea(int(start, 16), int(end, 16), device.rstrip(" *"), device.endswith("*"))
+                      for start, end, device in (line.split(maxsplit=2) for line in _cx16_areas.strip().splitlines())]
+        self.area_starts = [area.start for area in self.areas]
+        self.registers = dict(_cx16_registers)
+        self.rom_labels: dict[int, Tuple[list[int], list[str]]] = {}     # rom bank -> sorted addresses, names
+
+    def load_rom_symbols(self, bank: int, filename: str) -> None:
+        """loads the labels of the code in a ROM bank from a label file in VICE monitor format or in 64tass' --dump-labels format"""
+        labels = {}
+        for line in open(filename, "rt"):
+            match = _vice_label.match(line) or _dump_label.match(line)
+            if match:
+                address = int(match.group("address"), 16) & 0xffff     # ld65 writes 24 bit addresses
+                if address >= 0xc000:
+                    labels.setdefault(address, match.group("name").lstrip('.'))
+        addresses = sorted(labels)
+        self.rom_labels[bank] = (addresses, [labels[address] for address in addresses])
+
+    def area(self, address: int) -> Optional[MemoryArea]:
+        pos = bisect.bisect_right(self.area_starts, address) - 1
+        if pos >= 0 and address <= self.areas[pos].end:
+            return self.areas[pos]
+        return None
+
+    def device(self, address: int) -> Optional[str]:
+        """the name of the device or system memory area that the address is in, None if it's not in one"""
+        area = self.area(address)
+        return area.device if area else None
+
+    def name(self, bank: int, address: int) -> Optional[str]:
+        """the name of the register or kernal variable on the address, or for ROM the closest label before it (and the offset)"""
+        if address >= 0xc000:
+            addresses, names = self.rom_labels.get(bank, ([], []))
+            pos = bisect.bisect_right(addresses, address) - 1
+            if pos < 0:
+                return None
+            offset = address - addresses[pos]
+            return f"{names[pos]}+{offset}" if offset else names[pos]
+        return self.registers.get(address)
+
+
+def unknown_kind(address: int, memory_map: Optional[MemoryMap] = None, bank: int = 0) -> str:
+    """describes the kind of memory of an address that isn't found in the assembly listing"""
+    area = memory_map.area(address) if memory_map else None
+    if area:
+        name = memory_map.name(bank, address)
+        if address >= 0xc000:
+            return f"{area.device} bank {bank}: {name}" if name else f"{area.device} bank {bank}"
+        return f"{area.device}: {name}" if name else area.device
+    if address < 0x100:
+        return "unknown zp"
+    elif address < 0x200:
+        return "cpu stack"
+    elif address in range(0x9f00, 0xa000):
+        return "io"
+    else:
+        return "unknown"
+
+
+def device_accesses(asm: AsmList, stats: MemoryStats) -> list[Tuple[str, int, int, list[Tuple[str, int, int]]]]:
+    """
+    groups the reads and writes to the system memory areas (I/O devices, kernal variables, ROM) per device.
+    Addresses in areas that the program can also use (such as the kernal's zeropage) only count if they're not in the listing.
+    Returns (device, reads, writes, [(register, reads, writes)]) sorted on the total number of accesses, most accesses first;
+    the registers are sorted the same way.
+    """
+    totals = {}
+
+    def add(bank: int, address: int, reads: int, writes: int) -> None:
+        area = asm.memory_map.area(address)
+        if not area or (area.shared and asm.find(address)):
+            return
+        if address >= 0xc000:
+            device = f"{area.device} bank {bank}"
         else:
-            print("unknown")
+            device = area.device
+        register = asm.memory_map.name(bank, address) or f"${address:04x}"
+        registers = totals.setdefault(device, {})
+        register_reads, register_writes = registers.get(register, (0, 0))
+        registers[register] = (register_reads + reads, register_writes + writes)
 
-    print(f"\ntop {number_of_lines} most reads:")
-    for (bank, address), count in stats.reads[:number_of_lines]:
-        print(f"${address:04x} ({count}) : ", end="")
-        if bank == 0 and address < 0xa000:
-            result = asm.find(address)
-            if result:
-                lines = [f"${address:04x} '{line}' (line {line_number})" for address, line, line_number in result]
-                print(", ".join(lines))
+    for (bank, address), count in stats.reads:
+        add(bank, address, count, 0)
+    for (bank, address), count in stats.writes:
+        add(bank, address, 0, count)
+    result = []
+    for device, registers in totals.items():
+        per_register = sorted(((register, reads, writes) for register, (reads, writes) in registers.items()), key=lambda r: (-r[1] - r[2], r[0]))
+        result.append((device, sum(r[1] for r in per_register), sum(r[2] for r in per_register), per_register))
+    result.sort(reverse=True, key=lambda r: r[1] + r[2])
+    return result
+
+
+# the name of the code and data in a listing that is not inside any routine (such as the BASIC start stub)
+outside_routines = "<outside routines>"
+
+
+def routine_accesses(asm: AsmList, stats: MemoryStats) -> list[Tuple[str, int, int]]:
+    """
+    attributes all reads and writes to the routine or block that the address belongs to.
+    Returns (routine, reads, writes) sorted on the total number of accesses, most accesses first.
+    Accesses to the listing outside of any routine are counted as <outside routines> (just like their cycles are),
+    other accesses that can't be attributed to a routine are grouped by the kind of memory, such as <cpu stack>.
+    """
+    totals = {}
+
+    def attribute(bank: int, address: int) -> str:
+        listing = asm.listing_for(bank, address)
+        if listing:
+            routine = listing.routine(address)
+            if routine:
+                return routine
+            if listing.in_listing(address):
+                return outside_routines
+            if listing is asm:
+                return f"<{asm.memory_map.device(address) or unknown_kind(address)}>"
+            return f"<bank {bank}>"
+        return "<rom>" if address >= 0xc000 else "<banked memory>"
+
+    for (bank, address), count in stats.reads:
+        routine = attribute(bank, address)
+        reads, writes = totals.get(routine, (0, 0))
+        totals[routine] = (reads + count, writes)
+    for (bank, address), count in stats.writes:
+        routine = attribute(bank, address)
+        reads, writes = totals.get(routine, (0, 0))
+        totals[routine] = (reads, writes + count)
+    result = [(routine, reads, writes) for routine, (reads, writes) in totals.items()]
+    result.sort(reverse=True, key=lambda r: r[1] + r[2])
+    return result
+
+
+def instruction_cycles(asm: AsmList, stats: MemoryStats) -> list[Tuple[Instruction, int, int]]:
+    """
+    estimates the cycles spent on every instruction in the listing (and the listings of banked code).
+    The number of times an instruction was executed is taken to be the read count of its opcode byte (the opcode fetch),
+    which is multiplied by the base cycle count of the instruction.
+    Returns (instruction, executions, cycles) for the executed instructions, most cycles first.
+    """
+    reads = dict(stats.reads)
+    result = []
+    for instr in itertools.chain(asm.instructions, *(listing.instructions for listing in asm.banks.values())):
+        executions = reads.get((instr.bank if instr.address >= 0xa000 else 0, instr.address), 0)
+        if executions:
+            result.append((instr, executions, executions * instr.opcode.cycles))
+    result.sort(reverse=True, key=operator.itemgetter(2))
+    return result
+
+
+def routine_cycles(cycles: list[Tuple[Instruction, int, int]]) -> list[Tuple[str, int]]:
+    """sums the estimated instruction cycles per routine, returns (routine, cycles) with the most cycles first"""
+    totals = {}
+    for instr, _, instr_cycles in cycles:
+        routine = instr.scope or outside_routines
+        totals[routine] = totals.get(routine, 0) + instr_cycles
+    return sorted(totals.items(), reverse=True, key=operator.itemgetter(1))
+
+
+def sourceline_cycles(asm: AsmList, cycles: list[Tuple[Instruction, int, int]]) -> list[Tuple[SourceLine, int]]:
+    """
+    rolls up the estimated instruction cycles to the Prog8 source lines they were generated from.
+    Returns (source line, cycles) with the most cycles first. Needs a listing of assembly code that includes the source lines.
+    """
+    totals = {}
+    for instr, _, instr_cycles in cycles:
+        source = asm.listing_of(instr).sources.get(instr.line_number)
+        if source:
+            key = (source.file, source.line)
+            if key in totals:
+                totals[key] = (totals[key][0], totals[key][1] + instr_cycles)
             else:
-                print_unknown(address)
+                totals[key] = (source, instr_cycles)
+    return sorted(totals.values(), reverse=True, key=operator.itemgetter(1))
+
+
+# the zeropage locations that the compiler can allocate variables in on the Commander X16, per zeropage type
+# (see CX16Zeropage in the compiler), with dontuse the compiler doesn't put any variables in zeropage
+zeropage_pools = {
+    "basicsafe": [range(0x22, 0x80)],
+    "kernalsafe": [range(0x22, 0x80), range(0xa9, 0x100)],
+    "floatsafe": [range(0x22, 0x80), range(0xd4, 0x100)],
+    "full": [range(0x22, 0x100)],
+    "dontuse": [],
+}
+
+# the zeropage locations that the compiler always reserves for itself: the scratch registers $7a-$7f
+zeropage_reserved = range(0x7a, 0x80)
+
+datatype_sizes = {"bool": 1, "ubyte": 1, "byte": 1, "uword": 2, "word": 2, "long": 4, "float": 5}
+
+
+class CallGraph:
+    """
+    the static call graph of the program: the jsr (and jmp to other routines) instructions in the listing,
+    weighted by the number of times these call sites were executed.
+    The inclusive cost of a routine is its own (exclusive) estimated cycles plus the inclusive cost of the routines it calls,
+    where a callee's cost is divided over its callers in proportion to the number of calls they make.
+    Routines that (mutually) recurse form a cycle that is treated as a single routine: they all get the inclusive cost
+    of the whole cycle, and only the calls from outside the cycle share in that cost.
+    """
+
+    def __init__(self, asm: AsmList, cycles: list[Tuple[Instruction, int, int]]) -> None:
+        self.exclusive = dict(routine_cycles(cycles))
+        self.calls: dict[Tuple[str, str], int] = {}     # (caller, callee) -> number of calls
+        self.call_sites: list[Tuple[Instruction, str, int]] = []     # (call instruction, callee, number of calls)
+        for instr, executions, _ in cycles:
+            if instr.opcode.mnemonic in ("jsr", "jmp") and instr.opcode.mode == "abs":
+                caller = instr.scope or outside_routines
+                listing = asm.listing_for(instr.bank, instr.operand)
+                callee = listing.routine(instr.operand) if listing else None
+                callee = callee or f"${instr.operand:04x}"
+                if callee != caller:
+                    self.calls[(caller, callee)] = self.calls.get((caller, callee), 0) + executions
+                    self.call_sites.append((instr, callee, executions))
+        self.outgoing: dict[str, list[Tuple[str, int]]] = {}
+        for (caller, callee), calls in sorted(self.calls.items()):
+            self.outgoing.setdefault(caller, []).append((callee, calls))
+        routines = sorted(self.exclusive.keys() | {routine for call in self.calls for routine in call})
+        self.component = self.find_cycles(routines)
+        # the calls into a routine's cycle from outside it (for a routine that's not recursive, all of its calls)
+        self.incoming: dict[int, int] = {}
+        for (caller, callee), calls in self.calls.items():
+            if self.component[caller] != self.component[callee]:
+                self.incoming[self.component[callee]] = self.incoming.get(self.component[callee], 0) + calls
+        members: dict[int, list[str]] = {}
+        for routine in routines:
+            members.setdefault(self.component[routine], []).append(routine)
+        # the components are numbered callees first, so every callee's cost is known before its callers need it
+        cost: dict[int, float] = {}
+        for component in sorted(members):
+            cost[component] = sum(self.exclusive.get(routine, 0) for routine in members[component])
+            cost[component] += sum(cost[self.component[callee]] * calls / self.incoming[self.component[callee]]
+                                   for routine in members[component] for callee, calls in self.outgoing.get(routine, [])
+                                   if self.component[callee] != component)
+        self.inclusive: dict[str, float] = {routine: cost[self.component[routine]] for routine in routines}
+
+    def find_cycles(self, routines: list[str]) -> dict[str, int]:
+        """
+        numbers the strongly connected components of the call graph (Tarjan's algorithm, without recursion).
+        Returns the component number of every routine, a component's callees always have lower numbers than the component.
+        """
+        component: dict[str, int] = {}
+        order: dict[str, int] = {}
+        lowest: dict[str, int] = {}
+        stack: list[str] = []
+        on_stack: set[str] = set()
+        components = 0
+        for root in routines:
+            if root in order:
+                continue
+            work = [(root, iter(self.outgoing.get(root, [])))]
+            order[root] = lowest[root] = len(order)
+            stack.append(root)
+            on_stack.add(root)
+            while work:
+                routine, callees = work[-1]
+                for callee, _ in callees:
+                    if callee not in order:
+                        order[callee] = lowest[callee] = len(order)
+                        stack.append(callee)
+                        on_stack.add(callee)
+                        work.append((callee, iter(self.outgoing.get(callee, []))))
+                        break
+                    if callee in on_stack:
+                        lowest[routine] = min(lowest[routine], order[callee])
+                else:
+                    work.pop()
+                    if work:
+                        caller = work[-1][0]
+                        lowest[caller] = min(lowest[caller], lowest[routine])
+                    if lowest[routine] == order[routine]:
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            component[member] = components
+                            if member == routine:
+                                break
+                        components += 1
+        return component
+
+    def callee_share(self, caller: str, callee: str, calls: int) -> float:
+        """
+        the part of the callee's inclusive cost that is caused by the given number of calls to it from the caller.
+        Calls within a cycle of recursive routines cause no extra cost: that is already counted in the cycle's cost.
+        """
+        if self.component[caller] == self.component[callee]:
+            return 0.0
+        return self.inclusive[callee] * calls / self.incoming[self.component[callee]]
+
+    def callers(self, routine: str) -> list[Tuple[str, int]]:
+        """(caller, calls) of the routine, most calls first"""
+        return sorted(((caller, calls) for (caller, callee), calls in self.calls.items() if callee == routine),
+                      key=lambda c: (-c[1], c[0]))
+
+    def callees(self, routine: str) -> list[Tuple[str, int, float]]:
+        """(callee, calls, inclusive cycles caused by these calls) of the routine, most cycles first"""
+        return sorted(((callee, calls, self.callee_share(routine, callee, calls)) for callee, calls in self.outgoing.get(routine, [])),
+                      key=lambda c: (-c[2], c[0]))
+
+    def hottest(self) -> list[str]:
+        """the routines sorted on their inclusive cost, most expensive first"""
+        return sorted(self.inclusive, key=lambda routine: (-self.inclusive[routine], routine))
+
+
+def jump_target(instr: Instruction) -> Optional[int]:
+    """the address that a branch or jmp instruction jumps to, None for other instructions and indirect jumps"""
+    if instr.opcode.mode == "rel":
+        offset = instr.operand
+        return (instr.address + 2 + (offset - 256 if offset >= 128 else offset)) & 0xffff
+    if instr.opcode.mode == "zpr":
+        offset = instr.operand >> 8
+        return (instr.address + 3 + (offset - 256 if offset >= 128 else offset)) & 0xffff
+    if instr.opcode.mnemonic == "jmp" and instr.opcode.mode == "abs":
+        return instr.operand
+    return None
+
+
+# instructions after which the execution doesn't (always) continue with the next instruction
+_block_enders = {"jmp", "rts", "rti", "brk", "stp"}
+
+
+def ends_block(instr: Instruction) -> bool:
+    return instr.opcode.mnemonic in _block_enders or instr.opcode.mode in ("rel", "zpr")
+
+
+class BasicBlock(NamedTuple):
+    bank: int
+    start: int      # address of the first instruction
+    end: int        # address after the last instruction
+    instructions: list[Instruction]
+    executions: int     # times the block was entered (the fetch count of its first instruction)
+    cycles: int     # estimated cycles of all executions of the instructions in the block
+
+
+def basic_blocks(asm: AsmList, stats: MemoryStats) -> list[BasicBlock]:
+    """
+    splits the code in the listing (and the listings of banked code) into basic blocks, in address order per listing.
+    A new block starts at a label, at the target of a branch or jump, after a branch, jump or return instruction,
+    and where the code is interrupted by data.
+    """
+    reads = dict(stats.reads)
+    blocks = []
+    for listing in (asm, *asm.banks.values()):
+        instructions = sorted(listing.instructions, key=lambda instr: instr.address)
+        leaders = set(listing.labels.values())
+        leaders.update(target for target in map(jump_target, instructions) if target is not None)
+        current: list[Instruction] = []
+
+        def finish() -> None:
+            if current:
+                first, last = current[0], current[-1]
+                fetches = [reads.get((instr.bank if instr.address >= 0xa000 else 0, instr.address), 0) for instr in current]
+                cycles = sum(count * instr.opcode.cycles for count, instr in zip(fetches, current))
+                blocks.append(BasicBlock(first.bank, first.address, last.address + last.opcode.size, current.copy(), fetches[0], cycles))
+                current.clear()
+
+        for instr in instructions:
+            if current and (instr.address in leaders or instr.address != current[-1].address + current[-1].opcode.size):
+                finish()
+            current.append(instr)
+            if ends_block(instr):
+                finish()
+        finish()
+    return blocks
+
+
+class Loop(NamedTuple):
+    header: BasicBlock      # the block that the back-edge jumps to
+    back_edge: Instruction      # the branch or jump at the end of the loop
+    blocks: list[BasicBlock]    # all blocks from the header up to and including the back-edge
+    iterations: int     # estimated number of times the back-edge was taken
+    entries: int    # estimated number of times the loop was entered from outside
+    cycles: int     # estimated cycles spent in the blocks of the loop
+    innermost: bool     # the loop contains no other loops
+
+
+def find_loops(blocks: list[BasicBlock]) -> list[Loop]:
+    """
+    finds the loops in the code: branches and jumps back to an earlier block in the same listing (back-edges).
+    The number of iterations is estimated from the fetch counts: for a conditional branch it's the number of times the
+    branch was executed minus the number of times the next instruction was executed (the branch not taken).
+    Returns the loops sorted on their estimated cycles, most cycles first.
+    """
+    starts = {(block.bank, block.start): index for index, block in enumerate(blocks)}
+    back_edges = []
+    for index, block in enumerate(blocks):
+        last = block.instructions[-1]
+        target = jump_target(last)
+        header_index = starts.get((block.bank, target))
+        if target is not None and target <= last.address and header_index is not None:
+            back_edges.append((header_index, index))
+    loops = []
+    for header_index, index in back_edges:
+        block = blocks[index]
+        last = block.instructions[-1]
+        # the last instruction is executed as often as the block, as there are no jumps into the middle of a block
+        executed = block.executions
+        if last.opcode.mnemonic in ("jmp", "bra"):
+            taken = executed
         else:
-            print(f"banked memory: {bank:02x}:{address:04x}")
-    print(f"\ntop {number_of_lines} most writes:")
-    for (bank, address), count in stats.writes[:number_of_lines]:
-        print(f"${address:04x} ({count}) : ", end="")
-        if bank == 0 and address < 0xa000:
-            result = asm.find(address)
-            if result:
-                lines = [f"${address:04x} '{line}' (line {line_number})" for address, line, line_number in result]
-                print(", ".join(lines))
+            following = index + 1 < len(blocks) and blocks[index + 1].bank == block.bank and blocks[index + 1].start == block.end
+            taken = max(0, executed - blocks[index + 1].executions) if following else executed
+        header = blocks[header_index]
+        body = blocks[header_index:index + 1]
+        innermost = not any(header_index <= other_header <= other_index <= index and (other_header, other_index) != (header_index, index)
+                            for other_header, other_index in back_edges)
+        loops.append(Loop(header, last, body, taken, max(0, header.executions - taken), sum(b.cycles for b in body), innermost))
+    loops.sort(reverse=True, key=lambda loop: loop.cycles)
+    return loops
+
+
+def opcode_mix(blocks: list[BasicBlock], sequence_length: int = 1) -> list[Tuple[Tuple[Tuple[str, str], ...], int, int]]:
+    """
+    counts how often every instruction (as mnemonic and addressing mode), or every sequence of instructions of the given length,
+    was executed. Sequences are only counted within a basic block, all instructions of a block are executed as often as the block.
+    Returns (tuple of (mnemonic, mode) per instruction, executions, estimated cycles) with the most executions first.
+    """
+    totals = {}
+    for block in blocks:
+        if not block.executions:
+            continue
+        for index in range(len(block.instructions) - sequence_length + 1):
+            sequence = block.instructions[index:index + sequence_length]
+            key = tuple((instr.opcode.mnemonic, instr.opcode.mode) for instr in sequence)
+            executions, cycles = totals.get(key, (0, 0))
+            totals[key] = (executions + block.executions, cycles + block.executions * sum(instr.opcode.cycles for instr in sequence))
+    return sorted(((key, executions, cycles) for key, (executions, cycles) in totals.items()), key=lambda item: (-item[1], item[0]))
+
+
+def group_opcode_mix(mix: list[Tuple[Tuple[Tuple[str, str], ...], int, int]], field: int) -> list[Tuple[str, int, int]]:
+    """sums the single instruction opcode mix per mnemonic (field 0) or per addressing mode (field 1)"""
+    totals = {}
+    for ((instr, ), executions, cycles) in mix:
+        total_executions, total_cycles = totals.get(instr[field], (0, 0))
+        totals[instr[field]] = (total_executions + executions, total_cycles + cycles)
+    return sorted(((name, executions, cycles) for name, (executions, cycles) in totals.items()), key=lambda item: (-item[1], item[0]))
+
+
+# the indexed instructions that take an extra cycle when the indexed address is on the next page (on the 65C02)
+_page_penalty_mnemonics = {"lda", "ldx", "ldy", "adc", "sbc", "and", "ora", "eor", "cmp", "bit", "asl", "lsr", "rol", "ror"}
+
+
+class PagePenalty(NamedTuple):
+    instr: Instruction
+    target: str     # the branch target address, or the name of the indexed array
+    executions: int
+    penalties: int      # estimated number of executions that took the extra cycle for crossing a page
+
+
+def page_penalties(asm: AsmList, stats: MemoryStats) -> list[PagePenalty]:
+    """
+    finds the executed branch instructions whose target is on another page, and the executed abs,X and abs,Y instructions
+    that index an array that crosses a page boundary. Both take an extra cycle when crossing the page.
+    A taken branch crosses the page every time, the number of times it was taken is estimated as the number of times it was
+    executed minus the number of times the next instruction was executed. For an array, the share of executions that crossed
+    the page is estimated from the share of the reads of the array that were on the next page(s).
+    Returns the penalties sorted on the number of wasted cycles, most first.
+    """
+    reads = dict(stats.reads)
+
+    def fetches(bank: int, address: int) -> int:
+        return reads.get((bank if address >= 0xa000 else 0, address), 0)
+
+    penalties = []
+    for listing in (asm, *asm.banks.values()):
+        for instr in listing.instructions:
+            executions = fetches(instr.bank, instr.address)
+            if not executions:
+                continue
+            if instr.opcode.mode in ("rel", "zpr"):
+                target = jump_target(instr)
+                following = instr.address + instr.opcode.size
+                if target >> 8 != following >> 8:
+                    taken = executions if instr.opcode.mnemonic == "bra" else max(0, executions - fetches(instr.bank, following))
+                    if taken:
+                        penalties.append(PagePenalty(instr, f"${target:04x}", executions, taken))
+            elif instr.opcode.mode in ("absx", "absy") and instr.opcode.mnemonic in _page_penalty_mnemonics:
+                data_listing = asm.listing_for(instr.bank, instr.operand)
+                extent = data_listing.symbol_range(instr.operand) if data_listing else None
+                if not extent or instr.operand >> 8 == (extent[2] - 1) >> 8:
+                    continue
+                name, _, end = extent
+                counts = [fetches(instr.bank, address) for address in range(instr.operand, end)]
+                crossing = sum(count for address, count in zip(range(instr.operand, end), counts) if address >> 8 != instr.operand >> 8)
+                if sum(counts):
+                    share = crossing / sum(counts)
+                else:
+                    share = sum(1 for address in range(instr.operand, end) if address >> 8 != instr.operand >> 8) / (end - instr.operand)
+                if round(executions * share):
+                    penalties.append(PagePenalty(instr, name, executions, round(executions * share)))
+    penalties.sort(reverse=True, key=lambda penalty: penalty.penalties)
+    return penalties
+
+
+# the number of bytes that instructions push on (positive) or pull from (negative) the cpu stack
+_stack_effects = {"pha": 1, "php": 1, "phx": 1, "phy": 1, "pla": -1, "plp": -1, "plx": -1, "ply": -1,
+                  "jsr": 2, "rts": -2, "brk": 3, "rti": -3}
+
+
+class StackProfile(NamedTuple):
+    deepest: Optional[int]      # the lowest stack address that was accessed, None if the stack wasn't used
+    reads: int
+    writes: int
+    histogram: list[Tuple[int, int, int, int]]   # (first address, last address, reads, writes) per range of stack addresses
+    push_pull: int      # estimated stack accesses by the push and pull instructions in the listing
+    calls: int      # estimated stack accesses by the jsr and rts instructions in the listing (and brk and rti)
+
+    @property
+    def max_depth(self) -> int:
+        """the maximum number of bytes that were on the stack (the stack grows down from $01ff)"""
+        return 0x200 - self.deepest if self.deepest is not None else 0
+
+
+def stack_profile(asm: AsmList, stats: MemoryStats, cycles: list[Tuple[Instruction, int, int]], range_size: int = 16) -> StackProfile:
+    """
+    profiles the use of the cpu stack ($0100-$01ff) from the read and write counts in that page,
+    with a histogram of the accesses per range of stack addresses.
+    The executed push, pull, jsr and rts instructions in the listing are used to estimate what part of the stack traffic they cause,
+    the rest is caused by code that is not in the listing (kernal routines, interrupt handlers) and by direct accesses to the stack.
+    """
+    reads = {address: count for (bank, address), count in stats.reads if 0x100 <= address < 0x200}
+    writes = {address: count for (bank, address), count in stats.writes if 0x100 <= address < 0x200}
+    touched = reads.keys() | writes.keys()
+    histogram = {}
+    for address in touched:
+        start = 0x100 + (address - 0x100) // range_size * range_size
+        range_reads, range_writes = histogram.get(start, (0, 0))
+        histogram[start] = (range_reads + reads.get(address, 0), range_writes + writes.get(address, 0))
+    push_pull = calls = 0
+    for instr, executions, _ in cycles:
+        effect = _stack_effects.get(instr.opcode.mnemonic)
+        if effect in (1, -1):
+            push_pull += executions
+        elif effect:
+            calls += executions * abs(effect)
+    return StackProfile(min(touched) if touched else None, sum(reads.values()), sum(writes.values()),
+                        sorted((start, start + range_size - 1, r, w) for start, (r, w) in histogram.items()), push_pull, calls)
+
+
+# instructions that write to their operand address
+_writing_mnemonics = {"sta", "stx", "sty", "stz", "inc", "dec", "asl", "lsr", "rol", "ror", "trb", "tsb"} | \
+                     {f"{prefix}{bit}" for prefix in ("rmb", "smb") for bit in range(8)}
+
+
+class CodeWrite(NamedTuple):
+    instr: Instruction      # the instruction that was written to (patched)
+    writes: int     # the number of writes to the bytes of the instruction
+    opcode_writes: int      # the number of writes to its opcode byte (the instruction itself was replaced)
+    executions: int     # the number of times the instruction was executed
+    writers: list[Tuple[Instruction, int]]      # the instructions in the listing that write to it, with their executions
+
+
+def code_writes(asm: AsmList, stats: MemoryStats) -> list[CodeWrite]:
+    """
+    finds the instructions in the listing (and the listings of banked code) that were written to while the program ran:
+    self-modifying code, or code that got overwritten by accident.
+    The instructions that write to them are looked up in the listing as well: the store and read-modify-write instructions
+    whose absolute operand is one of the written addresses. If there are none, the code was probably overwritten by accident
+    (or by code that is not in the listing, or with indexed or indirect addressing).
+    Returns the patched instructions sorted on the number of writes, most writes first.
+    """
+    reads = dict(stats.reads)
+    writes = dict(stats.writes)
+    if not writes:
+        return []
+    all_instructions = list(itertools.chain(asm.instructions, *(listing.instructions for listing in asm.banks.values())))
+
+    def memory_bank(bank: int, address: int) -> int:
+        return bank if address >= 0xa000 else 0
+
+    writers = {}
+    for instr in all_instructions:
+        if instr.opcode.mnemonic in _writing_mnemonics and instr.opcode.mode in ("abs", "zp"):
+            writers.setdefault((memory_bank(instr.bank, instr.operand), instr.operand), []).append(instr)
+    result = []
+    for instr in all_instructions:
+        bank = memory_bank(instr.bank, instr.address)
+        counts = [writes.get((bank, address), 0) for address in range(instr.address, instr.address + instr.opcode.size)]
+        if any(counts):
+            patchers = [writer for address in range(instr.address, instr.address + instr.opcode.size) for writer in writers.get((bank, address), [])]
+            result.append(CodeWrite(instr, sum(counts), counts[0], reads.get((bank, instr.address), 0),
+                                    [(writer, reads.get((memory_bank(writer.bank, writer.address), writer.address), 0)) for writer in patchers]))
+    result.sort(reverse=True, key=lambda write: write.writes)
+    return result
+
+
+class VariablesDump:
+    """parses the variables dump that the compiler prints with the -dumpvars option"""
+
+    def __init__(self, filename: str) -> None:
+        self.zeropage: list[Tuple[int, str, str]] = []     # (address, datatype, scoped name)
+        self.static: list[Tuple[str, str]] = []     # (datatype, scoped name)
+        section = None
+        for line in open(filename, "rt"):
+            if line.startswith("---- VARIABLES DUMP"):
+                section = None
+            elif line and not line[0].isspace():
+                section = line.strip()
+            elif line.strip():
+                fields = line.strip().split("\t")
+                if section == "ZeroPage:" and len(fields) >= 3:
+                    self.zeropage.append((int(fields[0].lstrip("$"), 16), fields[1], fields[2]))
+                elif section == "Static variables (not in ZeroPage):" and len(fields) >= 2:
+                    self.static.append((fields[0], fields[1]))
+        if not self.zeropage and not self.static:
+            raise IOError("variables dump file is not recognised as the output of the -dumpvars compiler option")
+
+    def free_zeropage(self, zeropage_type: str) -> set[int]:
+        """the zeropage locations that are still free for variables, given the zeropage type the program was compiled with"""
+        free = set()
+        for locations in zeropage_pools[zeropage_type]:
+            free.update(locations)
+        free.difference_update(zeropage_reserved)
+        allocated = sorted(self.zeropage)
+        for i, (address, datatype, _) in enumerate(allocated):
+            size = datatype_sizes.get(datatype)
+            if size is None:
+                # array or string: assume it occupies everything up to the next allocated variable
+                size = allocated[i + 1][0] - address if i + 1 < len(allocated) else 1
+            free.difference_update(range(address, address + max(size, 1)))
+        return free
+
+    def free_zeropage_runs(self, zeropage_type: str) -> list[range]:
+        """the runs of consecutive free zeropage locations (see free_zeropage()), in address order"""
+        runs = []
+        for address in sorted(self.free_zeropage(zeropage_type)):
+            if runs and runs[-1].stop == address:
+                runs[-1] = range(runs[-1].start, address + 1)
             else:
-                print_unknown(address)
+                runs.append(range(address, address + 1))
+        return runs
+
+
+def zeropage_savings(asm: AsmList, cycles: list[Tuple[Instruction, int, int]]) -> dict[int, int]:
+    """
+    estimates per address how many cycles would be saved if the instructions that access it
+    with an absolute addressing mode could use the equivalent zeropage addressing mode instead
+    """
+    zp_modes = {"abs": "zp", "absx": "zpx", "absy": "zpy"}
+    zp_opcodes = {(opcode.mnemonic, opcode.mode): opcode for opcode in opcodes.values()}
+    savings = {}
+    for instr, executions, _ in cycles:
+        zp_mode = zp_modes.get(instr.opcode.mode)
+        if zp_mode and instr.opcode.mnemonic not in ("jmp", "jsr"):
+            zp_opcode = zp_opcodes.get((instr.opcode.mnemonic, zp_mode))
+            if zp_opcode and zp_opcode.cycles < instr.opcode.cycles:
+                savings[instr.operand] = savings.get(instr.operand, 0) + executions * (instr.opcode.cycles - zp_opcode.cycles)
+    return savings
+
+
+def zeropage_advice(asm: AsmList, cycles: list[Tuple[Instruction, int, int]], variables: VariablesDump,
+                    zeropage_type: str) -> Tuple[list[Tuple[str, int, int]], int]:
+    """
+    determines what variables that are not yet in zeropage give the biggest cycle savings when they're put in the free
+    zeropage locations. A variable needs consecutive free locations, so every run of free locations is filled in turn
+    (the largest run first) by solving a 0/1 knapsack problem on the sizes of the variables that are left.
+    Returns the chosen (variable, size, saved cycles) with the biggest savings first, and the number of free zeropage bytes.
+    """
+    savings = zeropage_savings(asm, cycles)
+    candidates = []
+    for datatype, name in variables.static:
+        address = asm.lookup_label(name)
+        if address is None:
+            continue
+        size = datatype_sizes.get(datatype) or asm.size_at(address)
+        saving = sum(savings.get(a, 0) for a in range(address, address + size))
+        if saving > 0 and size <= 256:
+            candidates.append((strip_prefixes(name), size, saving))
+    runs = variables.free_zeropage_runs(zeropage_type)
+    chosen = []
+    for run in sorted(runs, key=len, reverse=True):
+        capacity = len(run)
+        # best[c] = (total saving, chosen candidate indexes) using at most c bytes of this run
+        best = [(0, ())] * (capacity + 1)
+        for i, (_, size, saving) in enumerate(candidates):
+            for c in range(capacity, size - 1, -1):
+                option = best[c - size][0] + saving
+                if option > best[c][0]:
+                    best[c] = (option, best[c - size][1] + (i,))
+        chosen.extend(candidates[i] for i in best[capacity][1])
+        candidates = [candidate for i, candidate in enumerate(candidates) if i not in best[capacity][1]]
+    chosen.sort(reverse=True, key=operator.itemgetter(2))
+    return chosen, sum(len(run) for run in runs)
+
+
+def analyze(number_of_lines: int, asm: AsmList, stats: MemoryStats, analyses: Collection[str] = (),
+            dumpvars: Optional[str] = None, zeropage_type: str = "kernalsafe") -> dict:
+    """
+    performs the profiling analysis and returns the results as a structure of dicts and lists (that can be written as JSON).
+    The top reads and writes are always included, the other analyses only if their name is in analyses
+    (see analysis_names), the zeropage advice is included if a variables dump file is given.
+    Every table has at most number_of_lines entries.
+    """
+    unknown = set(analyses) - set(analysis_names)
+    if unknown:
+        raise ValueError("unknown analyses: " + ", ".join(sorted(unknown)))
+    routines = "routines" in analyses
+    results = {
+        "listing": {"lines": len(asm.lines), "instructions": len(asm.instructions)},
+        "memorystats": {"distinct_reads": stats.distinct_reads, "distinct_writes": stats.distinct_writes,
+                        "total_reads": stats.total_reads, "total_writes": stats.total_writes},
+    }
+    if stats.files:
+        total = stats.total_reads + stats.total_writes
+        results["files"] = [dict(summary, share=(summary["total_reads"] + summary["total_writes"]) * 100 / total if total else 0.0)
+                            for summary in stats.files]
+
+    def access(bank: int, address: int, count: int) -> dict:
+        entry = {"bank": bank, "address": address, "count": count}
+        listing = asm.listing_for(bank, address)
+        if listing:
+            found = listing.find(address)
+            entry["lines"] = [{"address": line_address, "line": line, "line_number": line_number} for line_address, line, line_number in found]
+            if listing is not asm:
+                entry["listing"] = listing.filename
+            if not found and listing is asm:
+                entry["kind"] = unknown_kind(address, asm.memory_map, bank)
+            elif not found:
+                # not on a line of the bank's listing, but it can still be inside one of its labels or routines
+                entry["kind"] = listing.symbol(address) or listing.routine(address) or "unknown"
+            if routines:
+                entry["routine"] = listing.routine(address)
         else:
-            print(f"banked memory: {bank:02x}:{address:04x}")
+            entry["kind"] = unknown_kind(address, asm.memory_map, bank) if address >= 0xc000 else "banked memory"
+        return entry
 
+    results["reads"] = [access(bank, address, count) for (bank, address), count in stats.reads[:number_of_lines]]
+    results["writes"] = [access(bank, address, count) for (bank, address), count in stats.writes[:number_of_lines]]
 
-if __name__ == "__main__":
+    if routines:
+        total = stats.total_reads + stats.total_writes
+        results["routines"] = [{"routine": routine, "reads": reads, "writes": writes,
+                                "share": (reads + writes) * 100 / total if total else 0.0}
+                               for routine, reads, writes in routine_accesses(asm, stats)[:number_of_lines]]
+
+    if analyses or dumpvars:
+        estimated = instruction_cycles(asm, stats)
+        total = sum(c for _, _, c in estimated)
+    if "cycles" in analyses:
+        results["cycles"] = {
+            "total": total,
+            "instructions": [{"address": instr.address, "bank": instr.bank, "line": asm.listing_of(instr).line_texts[instr.line_number], "line_number": instr.line_number,
+                              "routine": instr.scope, "executions": executions, "cycles": instr_cycles,
+                              "share": instr_cycles * 100 / total if total else 0.0}
+                             for instr, executions, instr_cycles in estimated[:number_of_lines]],
+            "routines": [{"routine": routine, "cycles": routine_total, "share": routine_total * 100 / total if total else 0.0}
+                         for routine, routine_total in routine_cycles(estimated)[:number_of_lines]]
+        }
+    if "sourcelines" in analyses:
+        results["sourcelines"] = [{"file": source.file, "line": source.line, "text": source.text, "cycles": line_cycles,
+                                   "share": line_cycles * 100 / total if total else 0.0}
+                                  for source, line_cycles in sourceline_cycles(asm, estimated)[:number_of_lines]]
+    if "callgraph" in analyses:
+        graph = CallGraph(asm, estimated)
+        results["callgraph"] = [{"routine": routine, "inclusive": round(graph.inclusive[routine]), "exclusive": graph.exclusive.get(routine, 0),
+                                 "inclusive_share": graph.inclusive[routine] * 100 / total if total else 0.0,
+                                 "callers": [{"routine": caller, "calls": calls} for caller, calls in graph.callers(routine)],
+                                 "callees": [{"routine": callee, "calls": calls, "cycles": round(callee_cycles)}
+                                             for callee, calls, callee_cycles in graph.callees(routine)]}
+                                for routine in graph.hottest()[:number_of_lines]]
+    if "loops" in analyses:
+        loops = [loop for loop in find_loops(basic_blocks(asm, stats)) if loop.cycles]
+        results["loops"] = [{"routine": loop.back_edge.scope, "bank": loop.header.bank, "start": loop.header.start, "end": loop.blocks[-1].end,
+                             "line_number": loop.back_edge.line_number, "line": asm.listing_of(loop.back_edge).line_texts.get(loop.back_edge.line_number, ""),
+                             "iterations": loop.iterations, "entries": loop.entries,
+                             "iterations_per_entry": loop.iterations / loop.entries if loop.entries else float(loop.iterations),
+                             "blocks": len(loop.blocks), "cycles": loop.cycles, "share": loop.cycles * 100 / total if total else 0.0,
+                             "innermost": loop.innermost}
+                            for loop in loops[:number_of_lines]]
+    if "opcodes" in analyses:
+        blocks = basic_blocks(asm, stats)
+        mix = opcode_mix(blocks)
+        executed = sum(executions for _, executions, _ in mix)
+
+        def entries(counts: list[Tuple[str, int, int]]) -> list[dict]:
+            return [{"name": name, "executions": executions, "cycles": cycles, "share": executions * 100 / executed if executed else 0.0}
+                    for name, executions, cycles in counts[:number_of_lines]]
+
+        def sequences(length: int) -> list[Tuple[str, int, int]]:
+            return [("; ".join(f"{mnemonic} {mode}" for mnemonic, mode in key), executions, cycles)
+                    for key, executions, cycles in opcode_mix(blocks, length)]
+
+        results["opcodes"] = {"executed": executed, "mnemonics": entries(group_opcode_mix(mix, 0)), "modes": entries(group_opcode_mix(mix, 1)),
+                              "instructions": entries(sequences(1)), "pairs": entries(sequences(2)), "triples": entries(sequences(3))}
+    if "pages" in analyses:
+        penalties = page_penalties(asm, stats)
+        results["page_penalties"] = {
+            "total": sum(penalty.penalties for penalty in penalties),
+            "instructions": [{"bank": penalty.instr.bank, "address": penalty.instr.address, "routine": penalty.instr.scope,
+                              "line_number": penalty.instr.line_number,
+                              "line": asm.listing_of(penalty.instr).line_texts.get(penalty.instr.line_number, ""),
+                              "kind": "branch" if penalty.instr.opcode.mode in ("rel", "zpr") else "indexed", "target": penalty.target,
+                              "executions": penalty.executions, "cycles": penalty.penalties}
+                             for penalty in penalties[:number_of_lines]]
+        }
+    if "stack" in analyses:
+        stack = stack_profile(asm, stats, estimated)
+        traffic = stack.reads + stack.writes
+        results["stack"] = {"deepest": stack.deepest, "max_depth": stack.max_depth, "reads": stack.reads, "writes": stack.writes,
+                            "push_pull": stack.push_pull, "calls": stack.calls, "other": max(0, traffic - stack.push_pull - stack.calls),
+                            "histogram": [{"start": start, "end": end, "reads": r, "writes": w,
+                                           "share": (r + w) * 100 / traffic if traffic else 0.0} for start, end, r, w in stack.histogram]}
+    if "smc" in analyses:
+        patched = code_writes(asm, stats)
+        results["code_writes"] = [{"bank": write.instr.bank, "address": write.instr.address, "routine": write.instr.scope,
+                                   "line_number": write.instr.line_number,
+                                   "line": asm.listing_of(write.instr).line_texts.get(write.instr.line_number, ""),
+                                   "writes": write.writes, "opcode_writes": write.opcode_writes, "executions": write.executions,
+                                   "writers": [{"address": writer.address, "routine": writer.scope, "line_number": writer.line_number,
+                                                "executions": executions} for writer, executions in write.writers]}
+                                  for write in patched[:number_of_lines]]
+    if "devices" in analyses:
+        total_accesses = stats.total_reads + stats.total_writes
+        results["devices"] = [{"device": device, "reads": reads, "writes": writes,
+                               "share": (reads + writes) * 100 / total_accesses if total_accesses else 0.0,
+                               "registers": [{"name": name, "reads": register_reads, "writes": register_writes}
+                                             for name, register_reads, register_writes in registers[:number_of_lines]]}
+                              for device, reads, writes, registers in device_accesses(asm, stats)[:number_of_lines]]
+    if dumpvars:
+        advice, free_bytes = zeropage_advice(asm, estimated, VariablesDump(dumpvars), zeropage_type)
+        results["zeropage_advice"] = {
+            "zeropage": zeropage_type,
+            "free_bytes": free_bytes,
+            "variables": [{"name": name, "size": size, "saving": saving} for name, size, saving in advice[:number_of_lines]],
+            "total_saving": sum(saving for _, _, saving in advice)
+        }
+    return results
+
+
+def print_report(number_of_lines: int, results: dict) -> None:
+    """prints the profiling results as returned by analyze() as readable text"""
+    print("number of actual lines in the assembly listing:", results["listing"]["lines"])
+    print("number of decoded instructions in the listing :", results["listing"]["instructions"])
+    info = results["memorystats"]
+    print("number of distinct addresses read from  :", info["distinct_reads"])
+    print("number of distinct addresses written to :", info["distinct_writes"])
+    print(f"total number of reads  : {info['total_reads']} ({info['total_reads']//1_000_000}M)")
+    print(f"total number of writes : {info['total_writes']} ({info['total_writes']//1_000_000}M)")
+    if "files" in results:
+        print(f"\nbreakdown of the {len(results['files'])} memory statistics files:")
+        print("       reads      writes   share  hottest read           hottest write          file")
+        for f in results["files"]:
+            hottest = [f"{h['bank']:02x}:{h['address']:04x} ({h['count']})" for h in (f["hottest_read"], f["hottest_write"])]
+            print(f"{f['total_reads']:12d}{f['total_writes']:12d}{f['share']:7.2f}%  {hottest[0]:<23s}{hottest[1]:<23s}{f['file']}")
+
+    def print_access(entry: dict) -> None:
+        bank, address = entry["bank"], entry["address"]
+        print(f"${address:04x} ({entry['count']}) : ", end="")
+        if "listing" in entry:
+            print(f"bank {bank}: ", end="")
+        if entry.get("kind") == "banked memory":
+            print(f"banked memory: {bank:02x}:{address:04x}", end="")
+        elif entry.get("lines"):
+            print(", ".join(f"${line['address']:04x} '{line['line']}' (line {line['line_number']})" for line in entry["lines"]), end="")
+        else:
+            print(entry["kind"], end="")
+        if entry.get("routine"):
+            print(f"  [{entry['routine']}]", end="")
+        print()
+
+    print(f"\ntop {number_of_lines} most reads:")
+    for entry in results["reads"]:
+        print_access(entry)
+    print(f"\ntop {number_of_lines} most writes:")
+    for entry in results["writes"]:
+        print_access(entry)
+
+    if "routines" in results:
+        print(f"\ntop {number_of_lines} routines with the most memory accesses:")
+        print("       reads      writes       total   share  routine")
+        for r in results["routines"]:
+            print(f"{r['reads']:12d}{r['writes']:12d}{r['reads'] + r['writes']:12d}{r['share']:7.2f}%  {r['routine']}")
+
+    if ("cycles" in results or "sourcelines" in results) and not results["listing"]["instructions"]:
+        print("\nnote: no instructions were found (a label file doesn't contain them), so there are no cycle estimates")
+    if "cycles" in results:
+        total = results["cycles"]["total"]
+        print(f"\ntotal estimated number of cycles spent in the listed instructions: {total} ({total//1_000_000}M)")
+        print("(base cycles only: extra cycles for taken branches and page crossings are not included)")
+        print(f"\ntop {number_of_lines} instructions with the most estimated cycles:")
+        print("      cycles  executions   share  instruction")
+        for i in results["cycles"]["instructions"]:
+            routine = f"  [{i['routine']}]" if i["routine"] else ""
+            bank = f"bank {i['bank']}: " if i["bank"] else ""
+            print(f"{i['cycles']:12d}{i['executions']:12d}{i['share']:7.2f}%  {bank}${i['address']:04x} '{i['line']}' (line {i['line_number']}){routine}")
+        print(f"\ntop {number_of_lines} routines with the most estimated cycles:")
+        print("      cycles   share  routine")
+        for r in results["cycles"]["routines"]:
+            print(f"{r['cycles']:12d}{r['share']:7.2f}%  {r['routine']}")
+
+    if "sourcelines" in results:
+        if not results["sourcelines"]:
+            print("\nno Prog8 source lines found in the assembly listing (was the program compiled with -nosourcelines?)")
+        else:
+            print(f"\ntop {number_of_lines} hottest Prog8 source lines (by estimated cycles):")
+            print("      cycles   share  source line")
+            for line in results["sourcelines"]:
+                print(f"{line['cycles']:12d}{line['share']:7.2f}%  {line['file']}:{line['line']}  {line['text']}")
+
+    if "callgraph" in results:
+        print(f"\ntop {number_of_lines} routines with the most estimated inclusive cycles (including the routines they call):")
+        print("   inclusive   share   exclusive  routine")
+        for r in results["callgraph"]:
+            print(f"{r['inclusive']:12d}{r['inclusive_share']:7.2f}%{r['exclusive']:12d}  {r['routine']}")
+            for caller in r["callers"]:
+                print(f"{'':33s}called {caller['calls']} times by {caller['routine']}")
+            for callee in r["callees"]:
+                print(f"{'':33s}calls {callee['routine']} {callee['calls']} times ({callee['cycles']} cycles)")
+
+    if "loops" in results:
+        print(f"\ntop {number_of_lines} loops with the most estimated cycles (* = innermost loop):")
+        print("      cycles   share  iterations     entries  iters/entry  blocks  address      routine")
+        for loop in results["loops"]:
+            print(f"{loop['cycles']:12d}{loop['share']:7.2f}%{loop['iterations']:12d}{loop['entries']:12d}{loop['iterations_per_entry']:13.1f}"
+                  f"{loop['blocks']:8d}  ${loop['start']:04x}-${loop['end'] - 1:04x} {'*' if loop['innermost'] else ' '} {loop['routine']}"
+                  f"  '{loop['line']}' (line {loop['line_number']})")
+
+    if "opcodes" in results:
+        titles = {"mnemonics": "instructions", "modes": "addressing modes", "instructions": "instructions and addressing modes",
+                  "pairs": "instruction pairs", "triples": "instruction triples"}
+        print(f"\ntotal number of executed instructions: {results['opcodes']['executed']}")
+        for key, title in titles.items():
+            print(f"\ntop {number_of_lines} most executed {title}:")
+            print(f"  executions   share      cycles  {title}")
+            for entry in results["opcodes"][key]:
+                print(f"{entry['executions']:12d}{entry['share']:7.2f}%{entry['cycles']:12d}  {entry['name']}")
+
+    if "page_penalties" in results:
+        print(f"\ntop {number_of_lines} instructions with the most estimated cycles wasted on crossing a page:")
+        print("      wasted  executions  address  kind     target / array")
+        for penalty in results["page_penalties"]["instructions"]:
+            print(f"{penalty['cycles']:12d}{penalty['executions']:12d}    ${penalty['address']:04x}  {penalty['kind']:8s} {penalty['target']}"
+                  f"  in {penalty['routine']}  '{penalty['line']}' (line {penalty['line_number']})")
+        print(f"total estimated cycles wasted on page crossings: {results['page_penalties']['total']}")
+
+    if "stack" in results:
+        stack = results["stack"]
+        traffic = stack["reads"] + stack["writes"]
+        print("\ncpu stack usage:")
+        if stack["deepest"] is None:
+            print("the cpu stack was not used")
+        else:
+            print(f"deepest stack address accessed: ${stack['deepest']:04x} (maximum stack depth {stack['max_depth']} bytes)")
+            print(f"stack reads: {stack['reads']}  stack writes: {stack['writes']}")
+
+            def share(count: int) -> str:
+                return f"{count * 100 / traffic:.2f}%" if traffic else "-"
+
+            print(f"estimated stack accesses by push and pull instructions: {stack['push_pull']} ({share(stack['push_pull'])})")
+            print(f"estimated stack accesses by jsr and rts instructions  : {stack['calls']} ({share(stack['calls'])})")
+            print(f"other stack accesses (kernal, interrupts, direct)     : {stack['other']} ({share(stack['other'])})")
+            print("stack accesses per address range:")
+            print("  addresses         reads      writes   share")
+            for entry in stack["histogram"]:
+                print(f"  ${entry['start']:04x}-${entry['end']:04x}{entry['reads']:12d}{entry['writes']:12d}{entry['share']:7.2f}%")
+
+    if "code_writes" in results:
+        print(f"\ntop {number_of_lines} instructions that were written to (self-modifying code):")
+        print("      writes  executions  address  instruction")
+        for write in results["code_writes"]:
+            print(f"{write['writes']:12d}{write['executions']:12d}    ${write['address']:04x}  '{write['line']}' in {write['routine']} (line {write['line_number']})")
+            if write["opcode_writes"]:
+                print(f"{'':32s}the opcode itself was written {write['opcode_writes']} times")
+            for writer in write["writers"]:
+                print(f"{'':32s}written by ${writer['address']:04x} in {writer['routine']} (line {writer['line_number']}), executed {writer['executions']} times")
+            if not write["writers"]:
+                print(f"{'':32s}no instruction in the listing writes to it: accidentally overwritten?")
+        if not results["code_writes"]:
+            print("no instructions in the listing were written to")
+
+    if "devices" in results:
+        print(f"\ntop {number_of_lines} I/O devices and system memory areas with the most memory accesses:")
+        print("       reads      writes       total   share  device / register")
+        for device in results["devices"]:
+            print(f"{device['reads']:12d}{device['writes']:12d}{device['reads'] + device['writes']:12d}{device['share']:7.2f}%  {device['device']}")
+            for register in device["registers"]:
+                print(f"{register['reads']:12d}{register['writes']:12d}{register['reads'] + register['writes']:12d}{'':10s}{register['name']}")
+
+    if "zeropage_advice" in results:
+        advice = results["zeropage_advice"]
+        print(f"\nzeropage advice ({advice['free_bytes']} free bytes in {advice['zeropage']} zeropage):")
+        if advice["variables"]:
+            print("consider adding @zp to these variables (estimated saving, size, variable):")
+            for var in advice["variables"]:
+                print(f"{var['saving']:12d} cycles  {var['size']:3d} bytes  {var['name']}")
+            print(f"total estimated saving: {advice['total_saving']} cycles")
+        else:
+            print("no variables found that would be faster in zeropage")
+
+
+def write_csv(results: dict, out: TextIO) -> None:
+    """
+    writes the tables in the profiling results as returned by analyze() as CSV rows, the first column names the table.
+    Every column has one meaning in all tables, the cells that don't apply to a table are left empty.
+    """
+    columns = ["table", "rank", "bank", "address", "name", "line_number", "count", "reads", "writes", "executions", "cycles", "share",
+               "inclusive", "exclusive", "calls", "iterations", "entries", "size"]
+    writer = csv.DictWriter(out, columns, extrasaction="ignore")
+    writer.writeheader()
+
+    def rows(table: str, entries: list[dict]) -> None:
+        for rank, entry in enumerate(entries, 1):
+            writer.writerow({"table": table, "rank": rank, **entry})
+
+    for table in ("reads", "writes"):
+        rows(table, [{"bank": e["bank"], "address": f"${e['address']:04x}", "count": e["count"],
+                      "name": e["lines"][0]["line"] if e.get("lines") else e.get("kind"),
+                      "line_number": e["lines"][0]["line_number"] if e.get("lines") else ""} for e in results[table]])
+    if "routines" in results:
+        rows("routines", [{"name": r["routine"], "reads": r["reads"], "writes": r["writes"], "share": f"{r['share']:.4f}"} for r in results["routines"]])
+    if "cycles" in results:
+        rows("instruction_cycles", [{"address": f"${i['address']:04x}", "name": i["line"], "line_number": i["line_number"], "executions": i["executions"],
+                                     "cycles": i["cycles"], "share": f"{i['share']:.4f}"} for i in results["cycles"]["instructions"]])
+        rows("routine_cycles", [{"name": r["routine"], "cycles": r["cycles"], "share": f"{r['share']:.4f}"} for r in results["cycles"]["routines"]])
+    if "sourcelines" in results:
+        rows("sourcelines", [{"name": f"{line['file']}:{line['line']}", "line_number": line["line"], "cycles": line["cycles"],
+                              "share": f"{line['share']:.4f}"} for line in results["sourcelines"]])
+    if "callgraph" in results:
+        rows("callgraph", [{"name": r["routine"], "inclusive": r["inclusive"], "exclusive": r["exclusive"], "share": f"{r['inclusive_share']:.4f}",
+                            "calls": sum(caller["calls"] for caller in r["callers"])} for r in results["callgraph"]])
+    if "loops" in results:
+        rows("loops", [{"bank": loop["bank"], "address": f"${loop['start']:04x}", "name": loop["routine"], "line_number": loop["line_number"],
+                        "iterations": loop["iterations"], "entries": loop["entries"], "cycles": loop["cycles"], "share": f"{loop['share']:.4f}"}
+                       for loop in results["loops"]])
+    if "opcodes" in results:
+        for key in ("mnemonics", "modes", "instructions", "pairs", "triples"):
+            rows("opcode_" + key, [{"name": entry["name"], "executions": entry["executions"], "cycles": entry["cycles"],
+                                    "share": f"{entry['share']:.4f}"} for entry in results["opcodes"][key]])
+    if "page_penalties" in results:
+        rows("page_penalties", [{"bank": penalty["bank"], "address": f"${penalty['address']:04x}", "name": f"{penalty['kind']} {penalty['target']}",
+                                 "line_number": penalty["line_number"], "executions": penalty["executions"], "cycles": penalty["cycles"]}
+                                for penalty in results["page_penalties"]["instructions"]])
+    if "stack" in results:
+        rows("stack", [{"address": f"${entry['start']:04x}", "reads": entry["reads"], "writes": entry["writes"], "share": f"{entry['share']:.4f}"}
+                       for entry in results["stack"]["histogram"]])
+    if "code_writes" in results:
+        rows("code_writes", [{"bank": write["bank"], "address": f"${write['address']:04x}", "name": write["line"], "line_number": write["line_number"],
+                              "writes": write["writes"], "executions": write["executions"]} for write in results["code_writes"]])
+    if "devices" in results:
+        rows("devices", [{"name": device["device"], "reads": device["reads"], "writes": device["writes"], "share": f"{device['share']:.4f}"}
+                         for device in results["devices"]])
+    if "zeropage_advice" in results:
+        rows("zeropage_advice", [{"name": var["name"], "size": var["size"], "cycles": var["saving"]} for var in results["zeropage_advice"]["variables"]])
+
+
+def write_callgrind(asm: AsmList, cycles: list[Tuple[Instruction, int, int]], out: TextIO) -> None:
+    """
+    writes the estimated instruction cycles in the callgrind profile format, which can be opened in KCachegrind.
+    The listing files are used as the source files, the routines as functions and the listing line numbers as positions.
+    """
+    out.write("# callgrind format\n")
+    out.write("version: 1\n")
+    out.write("creator: prog8 profiler.py\n")
+    out.write("positions: line\n")
+    out.write("events: Cycles Executions\n")
+    out.write(f"summary: {sum(c for _, _, c in cycles)} {sum(e for _, e, _ in cycles)}\n\n")
+    per_routine = {}
+    for instr, executions, instr_cycles in cycles:
+        key = (instr.bank, instr.scope or outside_routines)
+        per_routine.setdefault(key, []).append((instr.line_number, instr_cycles, executions))
+    graph = CallGraph(asm, cycles)
+    calls_per_routine = {}
+    for instr, callee, calls in graph.call_sites:
+        key = (instr.bank, instr.scope or outside_routines)
+        calls_per_routine.setdefault(key, []).append((instr, callee, calls))
+
+    def filename(bank: int) -> str:
+        return os.path.abspath(asm.banks[bank].filename if bank else asm.filename)
+
+    for (bank, routine), costs in sorted(per_routine.items()):
+        out.write(f"fl={filename(bank)}\n")
+        out.write(f"fn={routine}\n")
+        for line_number, instr_cycles, executions in sorted(costs):
+            out.write(f"{line_number} {instr_cycles} {executions}\n")
+        # the calls to other routines, with the inclusive cycles they caused
+        for instr, callee, calls in calls_per_routine.get((bank, routine), []):
+            callee_bank = instr.bank if 0xa000 <= instr.operand < 0xc000 else 0
+            listing = asm.listing_for(callee_bank, instr.operand)
+            target = listing.find(instr.operand) if listing else []
+            if listing and not callee.startswith('$'):
+                out.write(f"cfl={filename(callee_bank)}\n")
+            out.write(f"cfn={callee}\n")
+            out.write(f"calls={calls} {target[0][2] if target else 0}\n")
+            out.write(f"{instr.line_number} {round(graph.callee_share(routine, callee, calls))}\n")
+        out.write("\n")
+
+
+def write_results(results: dict, output_format: str, output: Optional[str], print_text: Callable[[], None],
+                  write_csv_rows: Callable[[dict, TextIO], None]) -> None:
+    """writes the results in the given output format (text, json or csv) to the output file, or stdout if no file is given"""
+    out = open(output, "wt", newline="" if output_format == "csv" else None) if output else sys.stdout
+    try:
+        if output_format == "json":
+            json.dump(results, out, indent=2)
+            out.write("\n")
+        elif output_format == "csv":
+            write_csv_rows(results, out)
+        else:
+            with contextlib.redirect_stdout(out):
+                print_text()
+    finally:
+        if output:
+            out.close()
+
+
+def profile(number_of_lines: int, asmlist: str, memstats: Union[str, list[str]], analyses: Collection[str] = (),
+            dumpvars: Optional[str] = None, zeropage_type: str = "kernalsafe",
+            output_format: str = "text", output: Optional[str] = None, callgrind: Optional[str] = None, cache: bool = False,
+            processes: Optional[int] = None, banked_listings: Optional[dict[int, str]] = None,
+            rom_symbols: Optional[dict[int, str]] = None) -> dict:
+    """
+    performs profiling analysis of the given assembly listing file based on the given memory stats file.
+    The analyses to perform (besides the top reads and writes) are given by their names, see analysis_names.
+    If a list of memory stats files is given, their counts are combined (the files are read in parallel by the given number of processes).
+    The results are written in the given output format (text, json or csv) to the output file, or stdout if no file is given,
+    and returned as a structure of dicts and lists as well.
+    If a callgrind file name is given, the estimated instruction cycles are also written to that file in callgrind format.
+    If cache is True, the parsed listing file is cached to speed up subsequent runs on the same listing.
+    The banked listings map HiRAM bank numbers to the listing files of the code and data that is in those banks,
+    the rom symbols map ROM bank numbers to the label files of the code in those banks.
+    """
+    asm = AsmList(asmlist, cache)
+    for bank, filename in (banked_listings or {}).items():
+        asm.add_bank(AsmList(filename, cache, bank))
+    for bank, filename in (rom_symbols or {}).items():
+        asm.memory_map.load_rom_symbols(bank, filename)
+    # the per-routine profile needs all counts, the plain top-N report can use the streaming parse
+    full = analyses or dumpvars or callgrind
+    if isinstance(memstats, str):
+        memstats = [memstats]
+    if len(memstats) == 1:
+        stats = MemoryStats(memstats[0], top=None if full else number_of_lines)
+    else:
+        stats = MemoryStats.merge(memstats, top=None if full else number_of_lines, processes=processes)
+    results = analyze(number_of_lines, asm, stats, analyses, dumpvars, zeropage_type)
+    write_results(results, output_format, output, lambda: print_report(number_of_lines, results), write_csv)
+    if callgrind:
+        with open(callgrind, "wt") as out:
+            write_callgrind(asm, instruction_cycles(asm, stats), out)
+    return results
+
+
+def symbol_accesses(asm: AsmList, stats: MemoryStats) -> dict[str, Tuple[int, int]]:
+    """
+    attributes all reads and writes to the symbol that the address belongs to, so that they can be compared between builds
+    where the addresses are different. Returns symbol -> (reads, writes).
+    Addresses that don't belong to a symbol are kept as they are (these usually don't move between builds, such as I/O).
+    """
+    totals = {}
+
+    def attribute(bank: int, address: int) -> str:
+        listing = asm.listing_for(bank, address)
+        if listing is asm:
+            symbol = asm.symbol(address)
+            return strip_prefixes(symbol) if symbol else f"${address:04x} <{unknown_kind(address, asm.memory_map)}>"
+        if listing:
+            symbol = listing.symbol(address)
+            if symbol:
+                return strip_prefixes(symbol)
+        if address >= 0xc000:
+            # the ROM doesn't move between builds of the program
+            return f"<{unknown_kind(address, asm.memory_map, bank)}>"
+        return "<banked memory>"
+
+    for (bank, address), count in stats.reads:
+        symbol = attribute(bank, address)
+        reads, writes = totals.get(symbol, (0, 0))
+        totals[symbol] = (reads + count, writes)
+    for (bank, address), count in stats.writes:
+        symbol = attribute(bank, address)
+        reads, writes = totals.get(symbol, (0, 0))
+        totals[symbol] = (reads, writes + count)
+    return totals
+
+
+def access_deltas(before: dict[str, Tuple[int, int]], after: dict[str, Tuple[int, int]]) -> list[Tuple[str, int, int, int, int]]:
+    """
+    compares the (reads, writes) per name of two profiling runs.
+    Returns (name, reads before, reads after, writes before, writes after) sorted on the absolute change, biggest change first.
+    """
+    result = []
+    for name in before.keys() | after.keys():
+        reads1, writes1 = before.get(name, (0, 0))
+        reads2, writes2 = after.get(name, (0, 0))
+        if reads1 != reads2 or writes1 != writes2:
+            result.append((name, reads1, reads2, writes1, writes2))
+    result.sort(key=lambda d: (-abs(d[2] - d[1]) - abs(d[4] - d[3]), d[0]))
+    return result
+
+
+def profile_diff(number_of_lines: int, asmlist1: str, memstats1: str, asmlist2: str, memstats2: str, cache: bool = False,
+                 output_format: str = "text", output: Optional[str] = None, rom_symbols: Optional[dict[int, str]] = None) -> dict:
+    """
+    compares two profiling runs (of possibly different builds) and reports what symbols and routines got hotter or colder.
+    The results are written in the given output format (text, json or csv) to the output file, or stdout if no file is given,
+    and returned as a structure of dicts and lists as well.
+    The rom symbols map ROM bank numbers to the label files of the code in those banks (the ROM is the same for both runs).
+    """
+    runs = []
+    for asmlist, memstats in ((asmlist1, memstats1), (asmlist2, memstats2)):
+        asm = AsmList(asmlist, cache)
+        for bank, filename in (rom_symbols or {}).items():
+            asm.memory_map.load_rom_symbols(bank, filename)
+        runs.append((asm, MemoryStats(memstats)))
+    (asm1, stats1), (asm2, stats2) = runs
+
+    def deltas(before: dict[str, Tuple[int, int]], after: dict[str, Tuple[int, int]]) -> list[dict]:
+        return [{"name": name, "reads_before": reads1, "reads_after": reads2, "writes_before": writes1, "writes_after": writes2}
+                for name, reads1, reads2, writes1, writes2 in access_deltas(before, after)[:number_of_lines]]
+
+    routines1 = {routine: (reads, writes) for routine, reads, writes in routine_accesses(asm1, stats1)}
+    routines2 = {routine: (reads, writes) for routine, reads, writes in routine_accesses(asm2, stats2)}
+    results = {
+        "before": {"listing": asmlist1, "memorystats": memstats1, "total_reads": stats1.total_reads, "total_writes": stats1.total_writes},
+        "after": {"listing": asmlist2, "memorystats": memstats2, "total_reads": stats2.total_reads, "total_writes": stats2.total_writes},
+        "symbols": deltas(symbol_accesses(asm1, stats1), symbol_accesses(asm2, stats2)),
+        "routines": deltas(routines1, routines2),
+    }
+    write_results(results, output_format, output, lambda: print_diff_report(number_of_lines, results), write_diff_csv)
+    return results
+
+
+def print_diff_report(number_of_lines: int, results: dict) -> None:
+    """prints the comparison of two profiling runs as returned by profile_diff() as a human readable report"""
+    before, after = results["before"], results["after"]
+    print(f"total number of reads  : {before['total_reads']} -> {after['total_reads']} ({after['total_reads'] - before['total_reads']:+d})")
+    print(f"total number of writes : {before['total_writes']} -> {after['total_writes']} ({after['total_writes'] - before['total_writes']:+d})")
+
+    def print_deltas(deltas: list[dict]) -> None:
+        print("       reads before/after (change)          writes before/after (change)  name")
+        for d in deltas:
+            reads1, reads2, writes1, writes2 = d["reads_before"], d["reads_after"], d["writes_before"], d["writes_after"]
+            print(f"{reads1:12d}{reads2:12d} ({reads2 - reads1:+11d}){writes1:12d}{writes2:12d} ({writes2 - writes1:+11d})  {d['name']}")
+
+    print(f"\ntop {number_of_lines} symbols with the largest change in memory accesses:")
+    print_deltas(results["symbols"])
+    print(f"\ntop {number_of_lines} routines with the largest change in memory accesses:")
+    print_deltas(results["routines"])
+
+
+def write_diff_csv(results: dict, out: TextIO) -> None:
+    """writes the comparison of two profiling runs as returned by profile_diff() as CSV rows, the first column names the table"""
+    columns = ["table", "rank", "name", "reads_before", "reads_after", "writes_before", "writes_after"]
+    writer = csv.DictWriter(out, columns)
+    writer.writeheader()
+    for table in ("symbols", "routines"):
+        for rank, entry in enumerate(results[table], 1):
+            writer.writerow({"table": table, "rank": rank, **entry})
+
+
+class Access(NamedTuple):
+    bank: int
+    address: int
+    count: int
+    symbol: Optional[str]       # the (scoped) symbol that the address belongs to, None if it's not in a listing
+
+
+class SymbolCounts(NamedTuple):
+    symbol: str
+    bank: int
+    address: int
+    size: int       # the number of bytes that were counted
+    reads: int
+    writes: int
+
+
+class RoutineProfile(NamedTuple):
+    routine: str
+    reads: int      # memory accesses to the routine's code and data
+    writes: int
+    cycles: int     # estimated cycles of the routine's own instructions
+
+
+class InstructionProfile(NamedTuple):
+    instruction: Instruction
+    line: str       # the text of the listing line
+    executions: int
+    cycles: int
+
+
+class Profile:
+    """
+    a profiling session, to query the profile of a program from Python (in a notebook or a test harness for instance)
+    instead of running the command line tool for every question. For example:
+
+        prof = Profile("program.list", "memstats.txt")
+        prof.counts("main.start.counter")      # reads and writes of a variable
+        prof.top_routines(10)                  # the routines with the most estimated cycles
+
+    Nothing is parsed until a query needs it: the listing file(s) on the first query that needs symbols or instructions,
+    the memory stats file(s) on the first query that needs counts. The parsed data and the derived tables
+    (such as the estimated instruction cycles) are kept, so later queries are cheap.
+    The arguments are the same as those of profile().
+    """
+
+    def __init__(self, asmlist: str, memstats: Union[str, list[str]], cache: bool = True, banked_listings: Optional[dict[int, str]] = None,
+                 rom_symbols: Optional[dict[int, str]] = None, processes: Optional[int] = None) -> None:
+        self.asmlist = asmlist
+        self.memstats = [memstats] if isinstance(memstats, str) else list(memstats)
+        self.cache = cache
+        self.banked_listings = dict(banked_listings or {})
+        self.rom_symbols = dict(rom_symbols or {})
+        self.processes = processes
+
+    @functools.cached_property
+    def asm(self) -> AsmList:
+        asm = AsmList(self.asmlist, self.cache)
+        for bank, filename in self.banked_listings.items():
+            asm.add_bank(AsmList(filename, self.cache, bank))
+        for bank, filename in self.rom_symbols.items():
+            asm.memory_map.load_rom_symbols(bank, filename)
+        return asm
+
+    @functools.cached_property
+    def stats(self) -> MemoryStats:
+        if len(self.memstats) == 1:
+            return MemoryStats(self.memstats[0])
+        return MemoryStats.merge(self.memstats, processes=self.processes)
+
+    @functools.cached_property
+    def read_counts(self) -> dict[Tuple[int, int], int]:
+        """(bank, address) -> read count"""
+        return dict(self.stats.reads)
+
+    @functools.cached_property
+    def write_counts(self) -> dict[Tuple[int, int], int]:
+        """(bank, address) -> write count"""
+        return dict(self.stats.writes)
+
+    @functools.cached_property
+    def cycles(self) -> list[Tuple[Instruction, int, int]]:
+        """the estimated cycles per executed instruction, see instruction_cycles()"""
+        return instruction_cycles(self.asm, self.stats)
+
+    @functools.cached_property
+    def call_graph(self) -> CallGraph:
+        return CallGraph(self.asm, self.cycles)
+
+    @functools.cached_property
+    def blocks(self) -> list[BasicBlock]:
+        return basic_blocks(self.asm, self.stats)
+
+    def symbol(self, address: int, bank: int = 0) -> Optional[str]:
+        """the (scoped) symbol that the address belongs to"""
+        listing = self.asm.listing_for(bank, address)
+        return listing.symbol(address) if listing else None
+
+    def address_counts(self, address: int, bank: int = 0) -> Tuple[int, int]:
+        """the (reads, writes) of an address, the bank is only used for the banked memory at $a000 and up"""
+        key = (bank if address >= 0xa000 else 0, address)
+        return self.read_counts.get(key, 0), self.write_counts.get(key, 0)
+
+    def counts(self, symbol: str, size: Optional[int] = None) -> SymbolCounts:
+        """
+        the reads and writes of all bytes of a symbol, given by its scoped name (the p8 prefixes are optional).
+        Symbols in the listings of banked code are found too. The size of a variable is taken from the listing
+        (up to the next label), unless it's given. Raises KeyError if the symbol is unknown.
+        """
+        for bank, listing in ((0, self.asm), *sorted(self.asm.banks.items())):
+            address = listing.lookup_label(symbol)
+            if address is not None:
+                break
+        else:
+            raise KeyError(symbol)
+        if size is None:
+            extent = listing.symbol_range(address)
+            size = extent[2] - address if extent else 1
+        counts = [self.address_counts(addr, bank) for addr in range(address, address + size)]
+        return SymbolCounts(symbol, bank, address, size, sum(r for r, _ in counts), sum(w for _, w in counts))
+
+    def top_reads(self, number: int = 20) -> list[Access]:
+        return [Access(bank, address, count, self.symbol(address, bank)) for (bank, address), count in self.stats.reads[:number]]
+
+    def top_writes(self, number: int = 20) -> list[Access]:
+        return [Access(bank, address, count, self.symbol(address, bank)) for (bank, address), count in self.stats.writes[:number]]
+
+    @functools.cached_property
+    def routines(self) -> list[RoutineProfile]:
+        """all routines (and the memory areas outside of routines) with their accesses and estimated cycles, most cycles first"""
+        accesses = {routine: (reads, writes) for routine, reads, writes in routine_accesses(self.asm, self.stats)}
+        cycles = dict(routine_cycles(self.cycles))
+        result = [RoutineProfile(routine, *accesses.get(routine, (0, 0)), cycles.get(routine, 0)) for routine in accesses.keys() | cycles.keys()]
+        result.sort(key=lambda r: (-r.cycles, -r.reads - r.writes, r.routine))
+        return result
+
+    def top_routines(self, number: int = 20, by: str = "cycles") -> list[RoutineProfile]:
+        """the routines with the most estimated cycles, or with the most memory accesses if by is 'accesses'"""
+        if by == "cycles":
+            return self.routines[:number]
+        if by == "accesses":
+            return sorted(self.routines, key=lambda r: (-r.reads - r.writes, r.routine))[:number]
+        raise ValueError("by should be 'cycles' or 'accesses'")
+
+    def routine(self, name: str) -> RoutineProfile:
+        """the profile of a routine given by its scoped name, raises KeyError if it wasn't used"""
+        for routine in self.routines:
+            if routine.routine == name or strip_prefixes(routine.routine) == strip_prefixes(name):
+                return routine
+        raise KeyError(name)
+
+    def top_instructions(self, number: int = 20) -> list[InstructionProfile]:
+        """the instructions with the most estimated cycles"""
+        return [InstructionProfile(instr, self.asm.listing_of(instr).line_texts.get(instr.line_number, ""), executions, instr_cycles)
+                for instr, executions, instr_cycles in self.cycles[:number]]
+
+    def loops(self, number: int = 20) -> list[Loop]:
+        """the loops with the most estimated cycles"""
+        return [loop for loop in find_loops(self.blocks) if loop.cycles][:number]
+
+    def report(self, analyses: Collection[str] = (), number_of_lines: int = 20, dumpvars: Optional[str] = None,
+               zeropage_type: str = "kernalsafe") -> dict:
+        """the same results as profile() returns (as a structure of dicts and lists), without printing them"""
+        return analyze(number_of_lines, self.asm, self.stats, analyses, dumpvars, zeropage_type)
+
+
+# the analyses that analyze() and profile() can perform, with their command line option
+analysis_options = {
+    "routines": ("-r", "--routines", "also print the memory accesses per routine (subroutine or block)"),
+    "cycles": ("-c", "--cycles", "also print the estimated cycles per instruction and per routine"),
+    "sourcelines": ("-s", "--sourcelines", "also print the hottest Prog8 source lines (by estimated cycles)"),
+    "callgraph": ("-g", "--callgraph", "also print the call graph with the inclusive and exclusive estimated cycles per routine"),
+    "loops": ("-l", "--loops", "also print the hottest loops (found from the basic blocks of the code)"),
+    "opcodes": ("-m", "--opcodes", "also print the opcode mix: the most executed instructions, addressing modes and instruction sequences"),
+    "pages": ("-p", "--pages", "also print the branches and indexed array accesses that waste cycles on crossing a page"),
+    "stack": ("-k", "--stack", "also print the cpu stack usage: the maximum stack depth and the stack traffic"),
+    "smc": ("-w", "--smc", "also print the instructions that were written to (self-modifying code)"),
+    "devices": ("-d", "--devices", "also print the memory accesses per I/O device and system memory area (VERA, kernal variables, ...)"),
+}
+analysis_names = list(analysis_options)
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    """the command line tool, the arguments are taken from sys.argv if they're not given"""
     parser = argparse.ArgumentParser(description=program_description)
     parser.add_argument("-n", dest="number", type=int, default=20, help="amount of reads and writes to print (default 20)")
-    parser.add_argument("asmlistfile", type=str, help="the 64tass/turbo assembler listing file to read")
-    parser.add_argument("memorystatsfile", type=str, help="the X16 emulator memstats dump file to read")
-    args = parser.parse_args()
-    profile(args.number, args.asmlistfile, args.memorystatsfile)
+    for name, (short_option, long_option, help_text) in analysis_options.items():
+        parser.add_argument(short_option, long_option, dest=name, action="store_true", help=help_text)
+    parser.add_argument("-z", "--zpadvice", metavar="DUMPVARSFILE", help="advise what variables to put in zeropage, using the saved output of the compiler's -dumpvars option")
+    parser.add_argument("--zeropage", choices=list(zeropage_pools), default="kernalsafe", help="zeropage type the program was compiled with, for the zeropage advice (default kernalsafe)")
+    parser.add_argument("--diff", nargs=2, metavar=("ASMLISTFILE2", "MEMORYSTATSFILE2"), help="compare with a second profiling run and print the symbols and routines that got hotter or colder")
+    parser.add_argument("-f", "--format", choices=["text", "json", "csv"], default="text", help="output format (default text)")
+    parser.add_argument("-o", "--output", metavar="FILE", help="write the output to this file instead of to the screen")
+    parser.add_argument("--callgrind", metavar="FILE", help="also write the estimated instruction cycles to this file in callgrind format (for KCachegrind)")
+    parser.add_argument("-b", "--bank", action="append", default=[], metavar="BANK:ASMLISTFILE", help="assembly listing (or label file) of the code and data in the given HiRAM bank (can be given multiple times)")
+    parser.add_argument("--rom", action="append", default=[], metavar="BANK:LABELFILE", help="label file of the code in the given ROM bank (can be given multiple times)")
+    parser.add_argument("--nocache", action="store_true", help="don't use or write the cache of parsed listing files")
+    parser.add_argument("-j", "--jobs", type=int, help="number of processes to read multiple memstats dump files with (default: number of cpu cores)")
+    parser.add_argument("asmlistfile", type=str, help="the 64tass/turbo assembler listing file to read (or its label file, see below)")
+    parser.add_argument("memorystatsfile", type=str, nargs="+", help="the X16 emulator memstats dump file(s) to read, the counts of multiple files are combined")
+    args = parser.parse_args(argv)
+
+    def bank_files(bank_args: list[str], what: str) -> dict[int, str]:
+        files = {}
+        for bank_arg in bank_args:
+            bank, _, filename = bank_arg.partition(":")
+            if not bank.isdigit() or not filename:
+                parser.error(what)
+            files[int(bank)] = filename
+        return files
+
+    banked_listings = bank_files(args.bank, "banked listing should be given as BANK:ASMLISTFILE")
+    rom_symbols = bank_files(args.rom, "rom label file should be given as BANK:LABELFILE")
+    if args.diff:
+        if len(args.memorystatsfile) > 1:
+            parser.error("--diff can only compare a single memstats dump file per run")
+        unsupported = [analysis_options[name][1] for name in analysis_names if getattr(args, name)]
+        unsupported += [option for option, value in (("--zpadvice", args.zpadvice), ("--callgrind", args.callgrind), ("--bank", args.bank)) if value]
+        if unsupported:
+            parser.error("--diff can't be combined with " + ", ".join(unsupported))
+        profile_diff(args.number, args.asmlistfile, args.memorystatsfile[0], args.diff[0], args.diff[1], not args.nocache,
+                     args.format, args.output, rom_symbols)
+    else:
+        requested = [name for name in analysis_names if getattr(args, name)]
+        profile(args.number, args.asmlistfile, args.memorystatsfile, requested, args.zpadvice, args.zeropage,
+                args.format, args.output, args.callgrind, not args.nocache, args.jobs, banked_listings, rom_symbols)
+
+
+if __name__ == "__main__":
+    main()
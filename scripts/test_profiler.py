@@ -0,0 +1,81 @@
+"""
+Tests for profiler.py, run them with:  python -m unittest test_profiler  (in the scripts directory)
+"""
+
+import os
+import tempfile
+import unittest
+
+import profiler
+
+
+def write_files(directory: str, listing: str, memstats: str) -> tuple[str, str]:
+    asmlist = os.path.join(directory, "test.list")
+    with open(asmlist, "w") as out:
+        out.write("; 64tass Turbo Assembler Macro V1.59.3120 listing file\n")
+        out.write(";Offset\t;Hex\t\t;Source\n\n")
+        out.write(listing)
+    stats = os.path.join(directory, "memstats.txt")
+    with open(stats, "w") as out:
+        out.write("Usage counts for addresses in main memory and banks\n")
+        out.write(memstats)
+    return asmlist, stats
+
+
+class TestCallGraph(unittest.TestCase):
+    # main calls a, and a and b call each other
+    listing = (".0900\t\t\t\t\tmain\t.proc\n"
+               ".0900\t20 10 09\tjsr  a\n"
+               ".0903\t60\t\trts\n"
+               ".0904\t\t\t\t\t.pend\n"
+               ".0910\t\t\t\t\ta\t.proc\n"
+               ".0910\t20 20 09\tjsr  b\n"
+               ".0913\t60\t\trts\n"
+               ".0914\t\t\t\t\t.pend\n"
+               ".0920\t\t\t\t\tb\t.proc\n"
+               ".0920\t20 10 09\tjsr  a\n"
+               ".0923\t60\t\trts\n"
+               ".0924\t\t\t\t\t.pend\n")
+    memstats = ("r 0900 1\nr 0903 1\n"
+                "r 0910 500\nr 0913 500\n"
+                "r 0920 499\nr 0923 499\n")
+
+    def test_mutual_recursion(self):
+        with tempfile.TemporaryDirectory() as directory:
+            prof = profiler.Profile(*write_files(directory, self.listing, self.memstats), cache=False)
+            graph = prof.call_graph
+        self.assertEqual(graph.exclusive, {"main": 12, "a": 6000, "b": 5988})
+        # the cycle of a and b counts as a whole, and all of it is caused by the single caller from outside the cycle
+        self.assertEqual(graph.inclusive, {"main": 12000, "a": 11988, "b": 11988})
+        self.assertEqual(graph.hottest(), ["main", "a", "b"])
+        self.assertEqual(graph.callees("main"), [("a", 1, 11988)])
+        self.assertEqual(graph.callees("a"), [("b", 500, 0.0)])
+        self.assertEqual(graph.callers("a"), [("b", 499), ("main", 1)])
+
+
+class TestProfile(unittest.TestCase):
+    # the start stub is in the listing, but not inside a routine
+    listing = (".080d\t20 11 08\tjsr  main.start\n"
+               ".0810\t60\t\trts\n"
+               ".0811\t\t\t\t\tmain\t.proc\n"
+               ".0811\t\t\t\t\tstart\t.proc\n"
+               ".0811\ta9 00\t\tlda  #0\n"
+               ".0813\t60\t\trts\n"
+               ".0814\t\t\t\t\t.pend\n"
+               ".0814\t\t\t\t\t.pend\n")
+    memstats = ("r 080d 5\nr 080e 5\nr 080f 5\nr 0810 5\n"
+                "r 0811 5\nr 0812 5\nr 0813 5\n"
+                "r 9000 7\n")
+
+    def test_outside_routines(self):
+        with tempfile.TemporaryDirectory() as directory:
+            prof = profiler.Profile(*write_files(directory, self.listing, self.memstats), cache=False)
+            routines = prof.routines
+        # the accesses and the cycles of the code outside the routines are in the same record
+        self.assertEqual(routines, [profiler.RoutineProfile("<outside routines>", 20, 0, 60),
+                                    profiler.RoutineProfile("main.start", 15, 0, 40),
+                                    profiler.RoutineProfile("<unknown>", 7, 0, 0)])
+
+
+if __name__ == "__main__":
+    unittest.main()